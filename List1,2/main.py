@@ -1,37 +1,50 @@
+import hashlib
+import json
 import math
+import mmap
+import os
+import sys
+from multiprocessing import Pool
 
+import numpy as np
 
-def count_symbols():
-    symbols = dict()
-    cond_symbols = dict()
-    file_size = 0
-    with open(file_name, "rb") as f:
-        file = f.read()
-        for index, value in enumerate(file):
-            symbols[value] = symbols.get(value, 0) + 1
-            file_size += 1
-            if index == 0:
-                cond_symbols[(value, 0)] = cond_symbols.get((value, 0), 0) + 1
-            else:
-                cond_symbols[(value, file[index - 1])] = cond_symbols.get((value, file[index - 1]), 0) + 1
-    return symbols, cond_symbols, file_size
-
-
-def count_entropy():
-    entropy = 0
-    for s in symbols.values():
-        entropy += (math.log2(s) - math.log2(file_size)) * (s / file_size)
-    if entropy != 0:
-        entropy *= -1
-    return entropy
-
-
-def count_cond_entropy():
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.stats import entropy  # noqa: E402
+
+ALPHABET_SIZE = 256
+SHARD_SIZE = 16 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+CACHE_DIR = ".entropy_cache"
+# orders up to DENSE_ORDER count their grams with one bincount over every possible key
+DENSE_ORDER = 2
+
+
+def count_symbols(data, previous=0):
+    """Counts the bytes of data and its (previous, value) byte pairs with one bincount each."""
+    values = np.frombuffer(data, dtype=np.uint8)
+    symbols = np.bincount(values, minlength=ALPHABET_SIZE)
+    # cond_symbols[previous * 256 + value]; the first byte of a file is preceded by 0
+    pairs = values.astype(np.uint16)
+    pairs[1:] |= values[:-1].astype(np.uint16) << 8
+    pairs[:1] |= previous << 8
+    cond_symbols = np.bincount(pairs, minlength=ALPHABET_SIZE * ALPHABET_SIZE)
+    return symbols, cond_symbols, len(values)
+
+
+def count_entropy(symbols, file_size):
+    return entropy(symbols, file_size)
+
+
+def count_cond_entropy(symbols, cond_symbols, file_size):
+    symbols, cond_symbols = symbols.tolist(), cond_symbols.tolist()
     cond_entropy = 0
-    for s_key, s_value in symbols.items():
+    for s_key, s_value in enumerate(symbols):
+        if not s_value:
+            continue
         cond_sum = 0
-        for key, value in cond_symbols.items():
-            if key[1] == s_key:
+        row = s_key * ALPHABET_SIZE
+        for value in cond_symbols[row:row + ALPHABET_SIZE]:
+            if value:
                 cond_sum += (math.log2(value) - math.log2(s_value)) * (value / s_value)
         cond_entropy += cond_sum * (s_value / file_size)
     if cond_entropy != 0:
@@ -39,8 +52,266 @@ def count_cond_entropy():
     return cond_entropy
 
 
+def empty_contexts(order):
+    return np.zeros(0, dtype=key_dtype(order)), np.zeros(0, dtype=np.int64)
+
+
+def key_dtype(order):
+    """Grams of up to 8 bytes are packed big-endian into uint64 keys, longer ones are kept as raw bytes."""
+    return np.dtype(np.uint64) if order < 8 else np.dtype(f"V{order + 1}")
+
+
+def count_contexts(data, order):
+    """Counts (order + 1)-grams of data; the first order bytes are context only.
+
+    Returns the distinct grams as sorted keys of key_dtype(order) and their
+    counts. Keys sort like their bytes, so grams sharing a context are adjacent.
+    """
+    values = np.frombuffer(data, dtype=np.uint8)
+    window = order + 1
+    length = len(values) - order
+    if length <= 0:
+        return empty_contexts(order)
+    if window > 8:
+        grams = np.ascontiguousarray(np.lib.stride_tricks.sliding_window_view(values, window))
+        return np.unique(grams.view(key_dtype(order)).ravel(), return_counts=True)
+    keys = np.zeros(length, dtype=np.uint64)
+    for i in range(window):
+        keys <<= 8
+        keys |= values[i:i + length]
+    if order > DENSE_ORDER:
+        return np.unique(keys, return_counts=True)
+    counts = np.bincount(keys.view(np.int64), minlength=1 << 8 * window)
+    keys = np.flatnonzero(counts)
+    return keys.astype(np.uint64), counts[keys]
+
+
+def merge_contexts(total, part):
+    """Adds the gram counts part to total; both are (keys, counts) pairs of count_contexts."""
+    if not len(total[0]):
+        return part
+    keys = np.concatenate([total[0], part[0]])
+    counts = np.concatenate([total[1], part[1]])
+    order = np.argsort(keys, kind="stable")
+    keys, counts = keys[order], counts[order]
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+def count_order_entropy(contexts, file_size):
+    keys, counts = contexts
+    if not len(keys):
+        return 0
+    # grams of one context are adjacent, so every run of equal contexts is summed at once
+    if keys.dtype == np.uint64:
+        prefixes = keys >> 8
+        changes = prefixes[1:] != prefixes[:-1]
+    else:
+        prefixes = keys.view(np.uint8).reshape(len(keys), -1)[:, :-1]
+        changes = (prefixes[1:] != prefixes[:-1]).any(axis=1)
+    starts = np.flatnonzero(np.concatenate([[True], changes]))
+    context_totals = np.repeat(np.add.reduceat(counts, starts), np.diff(np.append(starts, len(keys))))
+    order_entropy = float(((np.log2(counts) - np.log2(context_totals)) * (counts / file_size)).sum())
+    if order_entropy != 0:
+        order_entropy *= -1
+    return order_entropy
+
+
+def count_shard(shard):
+    """Counts symbols ending in [start, end) of the file, reading the order bytes before start as context.
+
+    Contexts reaching before the beginning of the file are padded with zeros,
+    so every shard counts exactly the same grams as a single pass would.
+    """
+    file_name, start, end, order = shard
+    overlap = max(order, 1)
+    context_start = max(0, start - overlap)
+    with open(file_name, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = bytes(overlap - (start - context_start)) + mm[context_start:end]
+    symbols, cond_symbols, _ = count_symbols(data[overlap:], data[overlap - 1])
+    contexts = count_contexts(data[overlap - order:], order) if order > 1 else empty_contexts(order)
+    return symbols, cond_symbols, contexts
+
+
+def analyse_files(file_names, order=1, processes=None, shard_size=SHARD_SIZE):
+    """Counts files in shards of shard_size bytes; the shards of all files share one pool of processes.
+
+    Returns {file_name: (symbols, cond_symbols, contexts, file_size)} with the
+    unigram and bigram arrays of count_symbols and the (order + 1)-gram counts
+    of count_contexts (only for order > 1).
+    """
+    results = {}
+    shards = []
+    for file_name in file_names:
+        file_size = os.stat(file_name).st_size
+        results[file_name] = (np.zeros(ALPHABET_SIZE, dtype=np.int64),
+                              np.zeros(ALPHABET_SIZE * ALPHABET_SIZE, dtype=np.int64), empty_contexts(order),
+                              file_size)
+        shards += [(file_name, start, min(start + shard_size, file_size), order)
+                   for start in range(0, file_size, shard_size)]
+    pool = Pool(processes) if len(shards) > 1 and processes != 1 else None
+    try:
+        parts = pool.imap(count_shard, shards) if pool else map(count_shard, shards)
+        for shard, (part_symbols, part_cond_symbols, part_contexts) in zip(shards, parts):
+            symbols, cond_symbols, contexts, file_size = results[shard[0]]
+            symbols += part_symbols
+            cond_symbols += part_cond_symbols
+            results[shard[0]] = (symbols, cond_symbols, merge_contexts(contexts, part_contexts), file_size)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return results
+
+
+def analyse_file(file_name, order=1, processes=None, shard_size=SHARD_SIZE):
+    return analyse_files([file_name], order, processes, shard_size)[file_name]
+
+
+def file_digest(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HistogramCache:
+    """On-disk cache of per-file histograms, one JSON entry per file.
+
+    An entry is reused without reading the file when its size and mtime are
+    unchanged; when only the mtime changed, the content hash decides. The
+    (order + 1)-gram counts of every cached order are kept next to the entry
+    as the keys and counts arrays of count_contexts in an .npz file.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __entry_path(self, file_name):
+        key = hashlib.sha1(os.path.abspath(file_name).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def __contexts_path(self, file_name, order):
+        return os.path.splitext(self.__entry_path(file_name))[0] + f".{order}.npz"
+
+    def __load(self, file_name):
+        try:
+            with open(self.__entry_path(file_name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __save(self, file_name, entry):
+        path = self.__entry_path(file_name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(path + ".tmp", path)
+
+    def get(self, file_name, order):
+        entry = self.__load(file_name)
+        if entry is None:
+            return None
+        stat = os.stat(file_name)
+        if entry["size"] != stat.st_size:
+            return None
+        if entry["mtime"] != stat.st_mtime_ns:
+            if entry["digest"] != file_digest(file_name):
+                return None
+            entry["mtime"] = stat.st_mtime_ns
+            self.__save(file_name, entry)
+        contexts = empty_contexts(order)
+        if order > 1:
+            if order not in entry.get("context_orders", []):
+                return None
+            try:
+                with np.load(self.__contexts_path(file_name, order)) as cached:
+                    contexts = cached["keys"], cached["counts"]
+            except (OSError, ValueError, KeyError):
+                return None
+        symbols = np.array(entry["symbols"], dtype=np.int64)
+        cond_symbols = np.zeros(ALPHABET_SIZE * ALPHABET_SIZE, dtype=np.int64)
+        for index, count in entry["cond_symbols"].items():
+            cond_symbols[int(index)] = count
+        return symbols, cond_symbols, contexts, stat.st_size
+
+    def put(self, file_name, order, counts):
+        symbols, cond_symbols, contexts, file_size = counts
+        stat = os.stat(file_name)
+        digest = file_digest(file_name)
+        entry = self.__load(file_name)
+        # entries from before the contexts moved out of the JSON have no context_orders and are rewritten
+        if entry is None or entry["digest"] != digest or "context_orders" not in entry:
+            entry = {"context_orders": []}
+        entry.update({
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "digest": digest,
+            "symbols": symbols.tolist(),
+            "cond_symbols": {int(index): int(cond_symbols[index]) for index in np.flatnonzero(cond_symbols)}
+        })
+        if order > 1:
+            path = self.__contexts_path(file_name, order)
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, keys=contexts[0], counts=contexts[1])
+            os.replace(path + ".tmp", path)
+            if order not in entry["context_orders"]:
+                entry["context_orders"].append(order)
+        self.__save(file_name, entry)
+
+
+def collect_files(paths, skip_dir=None):
+    file_names = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs
+                                 if skip_dir is None or not os.path.samefile(os.path.join(root, d), skip_dir))
+                file_names += [os.path.join(root, name) for name in sorted(files)]
+        else:
+            file_names.append(path)
+    return file_names
+
+
+def analyse_corpus(paths, order=1, cache_dir=CACHE_DIR, processes=None):
+    cache = HistogramCache(cache_dir)
+    file_names = collect_files(paths, cache_dir)
+    results = {}
+    for file_name in file_names:
+        counts = cache.get(file_name, order)
+        if counts is not None:
+            results[file_name] = counts
+    changed = [file_name for file_name in file_names if file_name not in results]
+    for file_name, counts in analyse_files(changed, order, processes).items():
+        cache.put(file_name, order, counts)
+        results[file_name] = counts
+    return [(file_name, results[file_name]) for file_name in file_names]
+
+
+def bad_parameters():
+    print("Wrong parameters.")
+    print("Usage: python main.py [-k order] [-cache cache_dir] file_or_directory...")
+
+
 if __name__ == "__main__":
-    file_name = "testy.zip"
-    (symbols, cond_symbols, file_size) = count_symbols()
-    print("Entropy: ", count_entropy())
-    print("Conditional entropy: ", count_cond_entropy())
+    args = sys.argv[1:]
+    order = 1
+    cache_dir = CACHE_DIR
+    while len(args) > 1 and args[0] in ("-k", "-cache"):
+        if args[0] == "-k":
+            order = int(args[1])
+        else:
+            cache_dir = args[1]
+        args = args[2:]
+    if not args or order < 0 or any(not os.path.exists(path) for path in args):
+        bad_parameters()
+    else:
+        for file_name, (symbols, cond_symbols, contexts, file_size) in analyse_corpus(args, order, cache_dir):
+            print(file_name)
+            print("Entropy: ", count_entropy(symbols, file_size))
+            print("Conditional entropy: ", count_cond_entropy(symbols, cond_symbols, file_size))
+            if order > 1:
+                print(f"Order {order} conditional entropy: ", count_order_entropy(contexts, file_size))
+            print()
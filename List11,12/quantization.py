@@ -1,7 +1,15 @@
 import copy
 import math
+import os
+import sys
 from sys import argv
 
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import tga  # noqa: E402
+from common.metrics import Metrics, to_db  # noqa: E402
+
 
 class Pixel:
     def __init__(self, red=0, green=0, blue=0):
@@ -74,14 +82,15 @@ class Encode:
     def __init__(self, filename, k):
         self.width = None
         self.height = None
-        self.original = None
+        self.image_id = b""
         self.delta = self.__delta(k)
-        self.bitmap = self.__get_bitmap(filename)
-        self.original_bitmap = copy.deepcopy(self.bitmap)
+        self.original, self.bitmap = self.__get_bitmap(filename)
         self.encoded = self.bitmap
         self.decoded = None
+        self.reconstructed = None
         self.mse = {}
         self.snr = {}
+        self.psnr = {}
         self.partition = {
             "red": k,
             "green": k,
@@ -89,40 +98,25 @@ class Encode:
         }
 
     def __get_bitmap(self, filename):
-        with open(filename, "rb") as f:
-            image = f.read()
-
-        self.width = image[13] * 256 + image[12]
-        self.height = image[15] * 256 + image[14]
-        self.original = list(image)
-        image = image[18:]
-        result = []
-        for i in range(self.height):
-            row = []
-            for j in range(self.width):
-                index = 3 * (i * self.width + j)
-                pixel = Pixel(red=image[index + 2], green=image[index + 1], blue=image[index])
-
-                row.append(pixel)
-            result.insert(0, row)
-        return result
+        image = tga.read(filename)
+        self.width = image.width
+        self.height = image.height
+        self.image_id = image.image_id
+        pixels = np.array(image.pixels)
+        return pixels, [[Pixel(red=red, green=green, blue=blue) for blue, green, red in row] for row in pixels.tolist()]
 
     def __delta(self, bits):
         return 256 / 2 ** bits
 
     def image_to_file(self, image, output):
-
-        file = open(output, 'wb')
-        shift = 18
-
-        for i in range(self.height):
-            for j in range(self.width):
-                index = 3 * ((self.height - 1 - i) * self.width + j) + shift
-                image[i][j].fix_pixel_value()
-                self.original[index + 2] = int(image[i][j].red)
-                self.original[index + 1] = int(image[i][j].green)
-                self.original[index] = int(image[i][j].blue)
-        file.write(bytes(self.original))
+        """Writes image, rows of pixels, to output and returns it as a (height, width, 3) BGR array."""
+        for row in image:
+            for pixel in row:
+                pixel.fix_pixel_value()
+        pixels = np.array([[(int(pixel.blue), int(pixel.green), int(pixel.red)) for pixel in row] for row in image],
+                          dtype=np.uint8).reshape(self.height, self.width, 3)
+        tga.write(output, pixels, self.image_id)
+        return pixels
 
     def quantize(self):
         error = Pixel(0, 0, 0)
@@ -163,81 +157,33 @@ class Encode:
     def decode(self, output,decoded_file):
         previous = Pixel(0, 0, 0)
         tmp = Pixel(128, 128, 128)
-        image = self.__get_bitmap(output)
+        _, image = self.__get_bitmap(output)
         self.decoded = copy.deepcopy(image)
         for i in range(self.height):
             for j in range(self.width):
                 self.decoded[i][j] = (image[i][j] - tmp) * 2 + previous
                 previous = self.decoded[i][j]
                 self.decoded[i][j], previous = self.check_pixel_range(self.decoded[i][j], previous)
-        self.image_to_file(self.decoded,decoded_file)
-
-    def __mse_difference(self, i, j):
-        return (self.original_bitmap[i][j] - self.decoded[i][j]) ** 2
+        self.reconstructed = self.image_to_file(self.decoded,decoded_file)
 
-    def __snr_sum(self, i, j):
-        return self.original_bitmap[i][j] ** 2
-
-    def __snr_to_db(self, snr):
-        if snr == 0:
-            return 0
-        return 10 * math.log10(snr)
-
-    def count_mse(self):
-        red_mse = 0
-        green_mse = 0
-        blue_mse = 0
-        for i in range(self.height):
-            for j in range(self.width):
-                mse = self.__mse_difference(i, j)
-                red_mse += mse.red
-                green_mse += mse.green
-                blue_mse += mse.blue
-
-        mult = 1 / (self.height * self.width)
-        all_mse = mult * (red_mse + green_mse + blue_mse) / 3
-        red_mse *= mult
-        green_mse *= mult
-        blue_mse *= mult
-
-        self.mse = {
-            "all": all_mse,
-            "red": red_mse,
-            "green": green_mse,
-            "blue": blue_mse
-        }
-
-    def count_snr(self):
-        sum_red = 0
-        sum_green = 0
-        sum_blue = 0
-        for i in range(self.height):
-            for j in range(self.width):
-                snr = self.__snr_sum(i, j)
-                sum_red += snr.red
-                sum_green += snr.green
-                sum_blue += snr.blue
-        mult = 1 / (self.height * self.width)
-        red_snr = (sum_red * mult / self.mse["red"] if self.mse["red"] != 0 else math.inf)
-        green_snr = (sum_green * mult / self.mse["green"] if self.mse["green"] != 0 else math.inf)
-        blue_snr = (sum_blue * mult / self.mse["blue"] if self.mse["blue"] != 0 else math.inf)
-        all_snr = ((sum_red + sum_green + sum_blue) / 3 * mult / self.mse["all"] if self.mse["all"] != 0 else math.inf)
-        self.snr = {
-            "all": all_snr,
-            "red": red_snr,
-            "green": green_snr,
-            "blue": blue_snr
-        }
+    def count_errors(self):
+        metrics = Metrics()
+        metrics.update(self.original, self.reconstructed)
+        self.mse, self.snr, self.psnr = metrics.mse(), metrics.snr(), metrics.psnr()
 
     def print_errors(self):
         print(f"mse = {self.mse['all']}")
         print(f"mse(r) = {self.mse['red']}")
         print(f"mse(g) = {self.mse['green']}")
         print(f"mse(b) = {self.mse['blue']}")
-        print(f"SNR = {self.snr['all']} ({self.__snr_to_db(self.snr['all'])} dB)")
-        print(f"SNR(r) = {self.snr['red']} ({self.__snr_to_db(self.snr['red'])} dB)")
-        print(f"SNR(g) = {self.snr['green']} ({self.__snr_to_db(self.snr['green'])} dB)")
-        print(f"SNR(b) = {self.snr['blue']} ({self.__snr_to_db(self.snr['blue'])} dB)")
+        print(f"SNR = {self.snr['all']} ({to_db(self.snr['all'])} dB)")
+        print(f"SNR(r) = {self.snr['red']} ({to_db(self.snr['red'])} dB)")
+        print(f"SNR(g) = {self.snr['green']} ({to_db(self.snr['green'])} dB)")
+        print(f"SNR(b) = {self.snr['blue']} ({to_db(self.snr['blue'])} dB)")
+        print(f"PSNR = {self.psnr['all']} dB")
+        print(f"PSNR(r) = {self.psnr['red']} dB")
+        print(f"PSNR(g) = {self.psnr['green']} dB")
+        print(f"PSNR(b) = {self.psnr['blue']} dB")
 
 
 if __name__ == "__main__":
@@ -249,6 +195,5 @@ if __name__ == "__main__":
     encoded = quantization.quantize()
     quantization.image_to_file(encoded, output)
     quantization.decode(output,decoded_file)
-    quantization.count_mse()
-    quantization.count_snr()
+    quantization.count_errors()
     quantization.print_errors()
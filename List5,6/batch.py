@@ -0,0 +1,163 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from code_formats import FORMATS
+from dictionary_policies import DEFAULT_MAX_SIZE, POLICIES
+from fgk import DECODERS, Encode, FGK, decode_container, header_engine, is_container
+from lzw import Coding
+
+MANIFEST = "manifest.json"
+IO_THREADS = 8
+MAX_FILES_IN_FLIGHT = 64
+
+
+def fgk_encode(data):
+    target = io.BytesIO()
+    Encode().encode_stream(io.BytesIO(data), target)
+    return target.getvalue()
+
+
+def fgk_decode(data):
+    source, target = io.BytesIO(data), io.BytesIO()
+    if data and is_container(data[0]):
+        decode_container(source, target, processes=1)
+    else:
+        DECODERS[header_engine(data[0]) if data else FGK.ENGINE]().decode_stream(source, target)
+    return target.getvalue()
+
+
+def lzw_encode(data, code_format="binary", policy="none", max_size=DEFAULT_MAX_SIZE):
+    target = io.BytesIO()
+    Coding(512, None, code_format, policy, max_size).encode_stream(io.BytesIO(data), target)
+    return target.getvalue()
+
+
+def lzw_decode(data):
+    target = io.BytesIO()
+    Coding(512, None).decode_stream(io.BytesIO(data), target)
+    return target.getvalue()
+
+
+CODECS = {
+    "fgk": {"-encode": fgk_encode, "-decode": fgk_decode},
+    "lzw": {"-encode": lzw_encode, "-decode": lzw_decode}
+}
+
+
+def read_file(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+def write_file(file_name, data):
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, "wb") as f:
+        f.write(data)
+
+
+def output_name(relative_name, codec, flag):
+    suffix = "." + codec
+    if flag == "-encode":
+        return relative_name + suffix
+    return relative_name[:-len(suffix)] if relative_name.endswith(suffix) else relative_name + ".out"
+
+
+def collect_jobs(input_dir, output_dir, codec, flag):
+    jobs = []
+    output_path = os.path.abspath(output_dir)
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != output_path)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            if name == MANIFEST and os.path.samefile(root, input_dir):
+                continue
+            relative_name = os.path.relpath(source, input_dir)
+            jobs.append((relative_name, source, os.path.join(output_dir, output_name(relative_name, codec, flag))))
+    return jobs
+
+
+def is_up_to_date(source, target):
+    return os.path.exists(target) and os.stat(target).st_mtime_ns >= os.stat(source).st_mtime_ns
+
+
+async def process_file(job, coder, io_pool, cpu_pool, in_flight):
+    """Reads and writes on the thread pool, codes on the process pool."""
+    relative_name, source, target = job
+    loop = asyncio.get_running_loop()
+    async with in_flight:
+        if is_up_to_date(source, target):
+            return {"file": relative_name, "output": target, "status": "skipped",
+                    "input_size": os.stat(source).st_size, "output_size": os.stat(target).st_size}
+        try:
+            data = await loop.run_in_executor(io_pool, read_file, source)
+            start = time.perf_counter()
+            result = await loop.run_in_executor(cpu_pool, coder, data)
+            elapsed = time.perf_counter() - start
+            await loop.run_in_executor(io_pool, write_file, target, result)
+        except Exception as error:
+            return {"file": relative_name, "output": target, "status": "error", "error": repr(error),
+                    "input_size": os.stat(source).st_size, "output_size": 0}
+        return {"file": relative_name, "output": target, "status": "done",
+                "input_size": len(data), "output_size": len(result), "seconds": elapsed}
+
+
+async def process_tree(input_dir, output_dir, codec, flag, processes=None, options=None):
+    coder = partial(CODECS[codec][flag], **(options or {}))
+    in_flight = asyncio.Semaphore(MAX_FILES_IN_FLIGHT)
+    jobs = collect_jobs(input_dir, output_dir, codec, flag)
+    with ThreadPoolExecutor(IO_THREADS) as io_pool, ProcessPoolExecutor(processes) as cpu_pool:
+        return await asyncio.gather(*(process_file(job, coder, io_pool, cpu_pool, in_flight) for job in jobs))
+
+
+def batch(input_dir, output_dir, codec, flag, processes=None, options=None):
+    """Codes the tree input_dir into output_dir; options go to the coder, e.g. the code format of lzw_encode."""
+    start = time.perf_counter()
+    entries = asyncio.run(process_tree(input_dir, output_dir, codec, flag, processes, options))
+    elapsed = time.perf_counter() - start
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, MANIFEST), "w") as f:
+        json.dump({"codec": codec, "mode": flag, "files": entries}, f, indent=2)
+
+    done = [entry for entry in entries if entry["status"] == "done"]
+    input_size = sum(entry["input_size"] for entry in done)
+    output_size = sum(entry["output_size"] for entry in done)
+    print("Przetworzone pliki: ", len(done))
+    print("Pominięte pliki: ", sum(entry["status"] == "skipped" for entry in entries))
+    print("Błędy: ", sum(entry["status"] == "error" for entry in entries))
+    print("Dane wejściowe [B]: ", input_size)
+    print("Dane wyjściowe [B]: ", output_size)
+    if output_size:
+        print("Stopień kompresji: ", input_size / output_size)
+    if elapsed:
+        print("Przepustowość [MB/s]: ", input_size / elapsed / 2 ** 20)
+
+
+def bad_parameters():
+    print("Błędne parametry.")
+
+
+if __name__ == "__main__":
+    # lzw coding options, as in lzw.py, but with binary codes by default
+    options = {}
+    while len(sys.argv) > 5 and sys.argv[3] in ("--format", "--policy", "--max-size"):
+        if sys.argv[3] == "--format":
+            options["code_format"] = sys.argv[4]
+        elif sys.argv[3] == "--policy":
+            options["policy"] = sys.argv[4]
+        else:
+            options["max_size"] = int(sys.argv[4])
+        del sys.argv[3:5]
+    valid_options = not options or sys.argv[1:3] == ["-encode", "lzw"] \
+        and options.get("code_format", "binary") in FORMATS and options.get("policy", "none") in POLICIES \
+        and 512 < options.get("max_size", DEFAULT_MAX_SIZE) < 2 ** 32
+    if len(sys.argv) == 5 and sys.argv[1] in ("-encode", "-decode") and sys.argv[2] in CODECS \
+            and os.path.isdir(sys.argv[3]) and valid_options:
+        batch(sys.argv[3], sys.argv[4], sys.argv[2], sys.argv[1], options=options)
+    else:
+        bad_parameters()
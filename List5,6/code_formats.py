@@ -0,0 +1,116 @@
+"""Code formats for the LZW output.
+
+Every format writes one code at a time to a BitWriter and reads it back from
+a BitReader. max_code is the largest code the dictionary can hold at that
+point, which the encoder and the decoder both know. Universal codes encode
+code + 1, since they have no codeword for zero.
+"""
+from bisect import bisect_right
+
+
+class FixedCode:
+    """4-byte little-endian codes, the original format of lzw.py."""
+
+    def write(self, writer, code, max_code):
+        writer.write(int.from_bytes(code.to_bytes(4, "little"), "big"), 32)
+
+    def read(self, reader, max_code):
+        return int.from_bytes(reader.read(32).to_bytes(4, "big"), "little")
+
+
+class BinaryCode:
+    """Binary codes as wide as max_code, so they grow with the dictionary."""
+
+    def write(self, writer, code, max_code):
+        writer.write(code, max(max_code.bit_length(), 1))
+
+    def read(self, reader, max_code):
+        return reader.read(max(max_code.bit_length(), 1))
+
+
+class GammaCode:
+    def write(self, writer, code, max_code):
+        self.write_number(writer, code + 1)
+
+    def read(self, reader, max_code):
+        return self.read_number(reader) - 1
+
+    def write_number(self, writer, n):
+        length = n.bit_length()
+        writer.write(0, length - 1)
+        writer.write(n, length)
+
+    def read_number(self, reader):
+        zeros = 0
+        while not reader.read_bit():
+            zeros += 1
+        return 1 << zeros | reader.read(zeros)
+
+
+class DeltaCode(GammaCode):
+    def write_number(self, writer, n):
+        length = n.bit_length()
+        super().write_number(writer, length)
+        writer.write(n & ((1 << (length - 1)) - 1), length - 1)
+
+    def read_number(self, reader):
+        length = super().read_number(reader)
+        return 1 << (length - 1) | reader.read(length - 1)
+
+
+class OmegaCode(GammaCode):
+    def write_number(self, writer, n):
+        groups = []
+        while n > 1:
+            groups.append(n)
+            n = n.bit_length() - 1
+        for group in reversed(groups):
+            writer.write(group, group.bit_length())
+        writer.write(0, 1)
+
+    def read_number(self, reader):
+        n = 1
+        while reader.read_bit():
+            n = 1 << n | reader.read(n)
+        return n
+
+
+class FibonacciCode(GammaCode):
+    def __init__(self):
+        self.fibonacci = [1, 2]
+
+    def write_number(self, writer, n):
+        while self.fibonacci[-1] <= n:
+            self.fibonacci.append(self.fibonacci[-1] + self.fibonacci[-2])
+        index = bisect_right(self.fibonacci, n) - 1
+        # bits go out from the smallest Fibonacci number up and end with an extra 1
+        code = 1
+        for i in range(index, -1, -1):
+            if self.fibonacci[i] <= n:
+                n -= self.fibonacci[i]
+                code |= 1 << (index + 1 - i)
+        writer.write(code, index + 2)
+
+    def read_number(self, reader):
+        n, index, previous = 0, 0, 0
+        while True:
+            bit = reader.read_bit()
+            if bit and previous:
+                return n
+            if bit:
+                while len(self.fibonacci) <= index:
+                    self.fibonacci.append(self.fibonacci[-1] + self.fibonacci[-2])
+                n += self.fibonacci[index]
+            previous = bit
+            index += 1
+
+
+FORMATS = {
+    "fixed": FixedCode,
+    "binary": BinaryCode,
+    "gamma": GammaCode,
+    "delta": DeltaCode,
+    "omega": OmegaCode,
+    "fibonacci": FibonacciCode
+}
+FORMAT_IDS = list(FORMATS)
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+import time
+
+from fgk import DECODERS, ENCODERS, Data
+
+
+def measure(engine, file_name, directory, input_data=None):
+    compressed_file = os.path.join(directory, engine + ".bin")
+    decompressed_file = os.path.join(directory, engine + ".out")
+    encoder = ENCODERS[engine]
+    start = time.perf_counter()
+    code_length = encoder().encode(file_name, compressed_file, input_data)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    DECODERS[encoder.ENGINE]().decode(compressed_file, decompressed_file)
+    decode_time = time.perf_counter() - start
+    with open(file_name, "rb") as f, open(decompressed_file, "rb") as d:
+        if f.read() != d.read():
+            raise ValueError(f"{engine}: odkodowany plik różni się od {file_name}")
+    return code_length, encode_time, decode_time
+
+
+def compare(file_names):
+    print(f"{'plik':<20} {'silnik':<7} {'entropia':>9} {'bity/symbol':>12} {'kodowanie KB/s':>15} "
+          f"{'dekodowanie KB/s':>17}")
+    with tempfile.TemporaryDirectory() as directory:
+        for file_name in file_names:
+            for engine in ENCODERS:
+                data = Data()
+                code_length, encode_time, decode_time = measure(engine, file_name, directory, data)
+                size_kb = data.all_symbols / 1024
+                print(f"{os.path.basename(file_name):<20} {engine:<7} {data.count_entropy():>9.4f} "
+                      f"{data.average_length(code_length):>12.4f} {size_kb / encode_time:>15.1f} "
+                      f"{size_kb / decode_time:>17.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        compare(sys.argv[1:])
+    else:
+        print("Błędne parametry.")
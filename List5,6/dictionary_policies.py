@@ -0,0 +1,123 @@
+"""Growth policies of the LZW dictionary.
+
+The encoder and the decoder drive the same policy object with the same calls
+in the same order, so both end up with the same codes in the same slots:
+use() for every emitted code, add() for every new entry and reset() on
+CLEAR_CODE. The decoder adds each entry one code later than the encoder,
+hence pending in max_code().
+"""
+from collections import OrderedDict, defaultdict
+
+# single bytes use codes 0-255 of the 512-entry alphabet, so 256 and 257 are free
+CLEAR_CODE = 256
+END_OF_STREAM = 257
+CHECK_INTERVAL = 10000
+DEFAULT_MAX_SIZE = 65536
+
+
+class DictionaryPolicy:
+    """Unbounded dictionary, the original behaviour of lzw.py."""
+
+    def __init__(self, alphabet_size, max_size=None):
+        self.alphabet_size = alphabet_size
+        self.max_size = max_size
+        self.reset()
+
+    def reset(self):
+        self.next_code = self.alphabet_size
+
+    def max_code(self, pending=False):
+        """Returns the largest code the next emitted code can have."""
+        return self.next_code - 1 + pending
+
+    def use(self, code):
+        pass
+
+    def add(self, prefix):
+        """Returns the code of a new entry extending prefix, or None when nothing is added."""
+        code = self.next_code
+        self.next_code += 1
+        return code
+
+    def should_reset(self, bytes_in, bits_out):
+        return False
+
+
+class FreezePolicy(DictionaryPolicy):
+    """Stops adding entries once max_size codes are in use."""
+
+    def max_code(self, pending=False):
+        return min(self.next_code - 1 + pending, self.max_size - 1)
+
+    def add(self, prefix):
+        if self.next_code >= self.max_size:
+            return None
+        return super().add(prefix)
+
+
+class ResetPolicy(FreezePolicy):
+    """Freezes the full dictionary and clears it when the compression ratio drops, like compress(1).
+
+    Once the dictionary is full the encoder checks the ratio of the input
+    coded since the last reset every CHECK_INTERVAL bytes.
+    """
+
+    def reset(self):
+        super().reset()
+        self.best_ratio = 0
+        self.checkpoint = 0
+
+    def should_reset(self, bytes_in, bits_out):
+        if self.next_code < self.max_size or bytes_in < self.checkpoint:
+            return False
+        self.checkpoint = bytes_in + CHECK_INTERVAL
+        ratio = bytes_in * 8 / bits_out
+        if ratio >= self.best_ratio:
+            self.best_ratio = ratio
+            return False
+        return True
+
+
+class LruPolicy(FreezePolicy):
+    """Replaces the least recently emitted entry once the dictionary is full.
+
+    Only leaves (entries that are no prefix of another entry) are replaced,
+    so every remaining entry still expands through its prefixes.
+    """
+
+    def reset(self):
+        super().reset()
+        self.leaves = OrderedDict()
+        self.prefixes = dict()
+        self.children = defaultdict(int)
+
+    def use(self, code):
+        if code in self.leaves:
+            self.leaves.move_to_end(code)
+
+    def add(self, prefix):
+        if self.next_code < self.max_size:
+            code = super().add(prefix)
+        else:
+            code = next((leaf for leaf in self.leaves if leaf != prefix), None)
+            if code is None:
+                return None
+            del self.leaves[code]
+            parent = self.prefixes[code]
+            self.children[parent] -= 1
+            if not self.children[parent] and parent >= self.alphabet_size:
+                self.leaves[parent] = None
+        self.prefixes[code] = prefix
+        self.children[prefix] += 1
+        self.leaves.pop(prefix, None)
+        self.leaves[code] = None
+        return code
+
+
+POLICIES = {
+    "none": DictionaryPolicy,
+    "freeze": FreezePolicy,
+    "reset": ResetPolicy,
+    "lru": LruPolicy
+}
+POLICY_IDS = list(POLICIES)
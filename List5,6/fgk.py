@@ -1,191 +1,375 @@
-import math
+import io
 import os
 import sys
-
-
-class Data:
-    def __init__(self, file_name):
-        self.file_name = file_name
-        self.symbols_count = dict()
-        self.all_symbols = 0
-
-    def count_symbols(self):
-        with open(self.file_name, "rb") as f:
-            file = f.read()
-            for index, value in enumerate(file):
-                self.symbols_count[value] = self.symbols_count.get(value, 0) + 1
-        self.all_symbols = os.stat(self.file_name).st_size
-
-    def count_entropy(self):
-        entropy = 0
-        for s in self.symbols_count.values():
-            entropy += (math.log2(s) - math.log2(self.all_symbols)) * (s / self.all_symbols)
-        if entropy != 0:
-            entropy *= -1
-        return entropy
-
-    def count_compress_ratio(self, initial, compressed):
-        return os.stat(initial).st_size / os.stat(compressed).st_size
-
-    def average_length(self, code, initial):
-        return len(code) / os.stat(initial).st_size
+from contextlib import nullcontext
+from multiprocessing import Pool
+from struct import calcsize, pack, unpack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.bitio import BUFFER_SIZE, BitReader, BitWriter  # noqa: E402
+from common.stats import CountingStream, Data, count_compress_ratio  # noqa: E402
+
+# A stream starts with the engine number instead of the padding header and its
+# NYT literals are 9 bits long, so that END_OF_STREAM can follow the last NYT code.
+# The padding header keeps the engine number in bit 6.
+STREAM_HEADER = 0
+END_OF_STREAM = 256
+# A container holds independently coded stream blocks of BLOCK_SIZE input
+# bytes, followed by the block index and a footer pointing at the index.
+CONTAINER_HEADER = 0x10
+BLOCK_SIZE = 1024 * 1024
+CONTAINER_FORMAT = "<BI"
+INDEX_ENTRY_FORMAT = "<QII"
+FOOTER_FORMAT = "<QI"
 
 
 class Node:
-    def __init__(self, parent=None, left=None, right=None, value=0, sign=''):
+    def __init__(self, parent=None, left=None, right=None, value=0, sign='', number=0):
         super(Node, self).__init__()
         self.parent = parent
         self.left = left
         self.right = right
         self.value = value
         self.sign = sign
+        self.number = number
 
     def is_leaf(self):
         return self.left is None and self.right is None
 
 
 class FGK:
+    ENGINE = 0
+
     def __init__(self):
         self.NYT = Node(sign="NYT")
         self.root = self.NYT
-        self.nodes = []
+        # implicit numbering: numbers grow from NYT towards the root and
+        # weights never decrease with the number, so every weight is a block
+        self.nodes = dict()
+        self.leaders = dict()
         self.tree_nodes = dict()
 
-    def __swap_nodes(self, node1, node2):
-        i, j = self.nodes.index(node1), self.nodes.index(node2)
-        self.nodes[i], self.nodes[j] = self.nodes[j], self.nodes[i]
-        node1.parent, node2.parent = node2.parent, node1.parent
+    def swap_nodes(self, node1, node2):
+        node1.number, node2.number = node2.number, node1.number
+        self.nodes[node1.number] = node1
+        self.nodes[node2.number] = node2
+        parent1, parent2 = node1.parent, node2.parent
+        left1, left2 = parent1.left is node1, parent2.left is node2
+        node1.parent, node2.parent = parent2, parent1
 
-        if node1.parent.left is node2:
-            node1.parent.left = node1
+        if left2:
+            parent2.left = node1
         else:
-            node1.parent.right = node1
+            parent2.right = node1
 
-        if node2.parent.left is node1:
-            node2.parent.left = node2
+        if left1:
+            parent1.left = node2
         else:
-            node2.parent.right = node2
+            parent1.right = node2
 
     def __find_largest_node(self, value):
-        for n in reversed(self.nodes):
-            if n.value == value:
-                return n
+        return self.nodes[self.leaders[value]]
+
+    def __increment(self, node):
+        value, number = node.value, node.number
+        if self.leaders[value] == number:
+            lower = self.nodes.get(number - 1)
+            if lower is not None and lower.value == value:
+                self.leaders[value] = number - 1
+            else:
+                del self.leaders[value]
+        node.value = value + 1
+        if self.leaders.get(value + 1, number) <= number:
+            self.leaders[value + 1] = number
 
     def __update_tree(self, node):
         while node:
             largest = self.__find_largest_node(node.value)
             if node is not largest and node is not largest.parent and largest is not node.parent:
-                self.__swap_nodes(node, largest)
-            node.value = node.value + 1
+                self.swap_nodes(node, largest)
+            self.__increment(node)
             node = node.parent
 
     def add_new_value(self, s):
         if s in self.tree_nodes:
             node = self.tree_nodes[s]
         else:
-            new = Node(sign=s, value=1)
-            parent = Node(self.NYT.parent, self.NYT, new, 1, "")
-            new.parent = parent
-            self.NYT.parent = parent
-            if parent.parent:
-                parent.parent.left = parent
-            else:
-                self.root = parent
-            self.nodes.insert(0, parent)
-            self.nodes.insert(0, new)
-            self.tree_nodes[s] = new
+            parent = self.split_nyt(s, 1)
+            if self.leaders.get(1, parent.number) <= parent.number:
+                self.leaders[1] = parent.number
             node = parent.parent
         self.__update_tree(node)
 
+    def split_nyt(self, s, value):
+        """Replaces NYT with a node of weight value whose children are NYT and a new leaf for s."""
+        new = Node(sign=s, value=value, number=self.NYT.number - 1)
+        parent = Node(self.NYT.parent, self.NYT, new, value, "", self.NYT.number)
+        self.NYT.number -= 2
+        new.parent = parent
+        self.NYT.parent = parent
+        if parent.parent:
+            parent.parent.left = parent
+        else:
+            self.root = parent
+        self.nodes[parent.number] = parent
+        self.nodes[new.number] = new
+        self.tree_nodes[s] = new
+        return parent
+
+    def get_code(self, node):
+        code, length = 0, 0
+        while node.parent:
+            if node.parent.right is node:
+                code |= 1 << length
+            length += 1
+            node = node.parent
+        return code, length
+
+
+class Vitter(FGK):
+    """Adaptive Huffman tree updated with Vitter's algorithm Λ.
+
+    Within one weight all leaves are numbered below the internal nodes, and
+    a node being incremented slides past the block that follows it instead
+    of being swapped with a single leader. This keeps the tree of minimal
+    height among the Huffman trees for the current weights.
+    """
+    ENGINE = 1
+
+    def __block_end(self, number, value, leaf):
+        while True:
+            above = self.nodes.get(number + 1)
+            if above is None or above.value != value or above.is_leaf() != leaf:
+                return number
+            number += 1
+
+    def __slide_and_increment(self, node):
+        parent = node.parent
+        leaf = node.is_leaf()
+        if leaf:
+            end = self.__block_end(node.number, node.value, False)
+        else:
+            end = self.__block_end(node.number, node.value + 1, True)
+        for number in range(node.number + 1, end + 1):
+            self.swap_nodes(node, self.nodes[number])
+        node.value += 1
+        return node.parent if leaf else parent
+
+    def add_new_value(self, s):
+        if s in self.tree_nodes:
+            node = self.tree_nodes[s]
+            leader = self.nodes[self.__block_end(node.number, node.value, True)]
+            if leader is not node:
+                self.swap_nodes(node, leader)
+            leaf_to_increment = None
+            if node.parent.left is self.NYT:
+                leaf_to_increment, node = node, node.parent
+        else:
+            node = self.split_nyt(s, 0)
+            leaf_to_increment = node.right
+        while node:
+            node = self.__slide_and_increment(node)
+        if leaf_to_increment:
+            self.__slide_and_increment(leaf_to_increment)
+
 
 class Encode(FGK):
-    def encode(self, file_name, compressed_file):
-        coded = open(compressed_file, 'w+b')
-        with open(file_name, "rb") as f:
-            file = f.read()
-            code = ""
-            for sign in file:
+    def encode(self, file_name, compressed_file, input_data=None, output_data=None):
+        """Codes file_name, counting its bytes into input_data and the written code into output_data."""
+        with open(compressed_file, 'w+b') as file, open(file_name, "rb") as source:
+            f, coded = CountingStream(source, input_data), CountingStream(file, output_data)
+            coded.write(bytes(1))
+            writer = BitWriter(coded)
+            self.__encode_symbols(f, writer, 8)
+            code_length = writer.bits_written
+            zero_count = self.__add_zeros(writer)
+            coded.seek(0)
+            coded.write(bytes([0x80 | self.ENGINE << 6 | zero_count]))
+        return 8 + code_length + zero_count
+
+    def encode_stream(self, source, target):
+        target.write(bytes([STREAM_HEADER | self.ENGINE]))
+        writer = BitWriter(target)
+        self.__encode_symbols(source, writer, 9)
+        writer.write(*self.get_code(self.NYT))
+        writer.write(END_OF_STREAM, 9)
+        writer.close()
+        return 8 + writer.bits_written
+
+    def __encode_symbols(self, source, writer, literal_length):
+        for chunk in iter(lambda: source.read(BUFFER_SIZE), b""):
+            for sign in chunk:
                 if sign in self.tree_nodes:
-                    code += self.__get_code(sign, self.root)
+                    writer.write(*self.get_code(self.tree_nodes[sign]))
                 else:
-                    code += self.__get_code('NYT', self.root)
-                    code += bin(sign)[2:].zfill(8)
+                    writer.write(*self.get_code(self.NYT))
+                    writer.write(sign, literal_length)
                 super().add_new_value(sign)
-            code = self.__add_zeros(code)
-            byte_list = [int(code[i:i + 8], 2) for i in range(0, len(code), 8)]
-            coded.write(bytearray(byte_list))
-            coded.close()
-
-        return code
 
-    def __add_zeros(self, code):
-        zero_count = 8 - len(code) % 8
-        zero_count_info = '1' + "{0:07b}".format(zero_count)
-        return zero_count_info + code + ''.join(["0"] * zero_count)
-
-    def __get_code(self, s, node1, code=''):
-        if not (node1.left or node1.right):
-            return code if node1.sign == s else ""
-        node2 = ""
-        if node1.left:
-            node2 = self.__get_code(s, node1.left, code + '0')
-        if not node2 and node1.right:
-            node2 = self.__get_code(s, node1.right, code + '1')
-        return node2
+    def __add_zeros(self, writer):
+        zero_count = 8 - writer.bits_written % 8
+        writer.write(0, zero_count)
+        writer.close()
+        return zero_count
 
 
 class Decode(FGK):
-    def __traverse(self, bits):
+    def __traverse(self, reader):
         node = self.root
-        for b in bits:
-            if b == '0':
-                node = node.left
-            else:
-                node = node.right
+        while node.left is not None:
+            node = node.right if reader.read_bit() else node.left
         return node
 
     def decode(self, file_name, decompressed_file):
-        decoded_file = open(decompressed_file, 'wb')
-        with open(file_name, "rb") as f:
-            byte = f.read(1)
-            code = ""
-            while byte != b"":
-                code += repr(bin(ord(byte)))[3:-1].zfill(8)
-                byte = f.read(1)
-
-            code = self.__remove_zeros(code)
-            decoded = []
-            sign = self.__get_sign_code(code[:8])
+        with open(file_name, "rb") as f, open(decompressed_file, 'wb') as decoded_file:
+            self.decode_stream(f, decoded_file)
+
+    def decode_stream(self, source, target):
+        header = source.read(1)
+        if not header:
+            return
+        if header_engine(header[0]) != self.ENGINE:
+            raise ValueError(f"Plik zakodowany innym silnikiem: {header_engine(header[0])}")
+        if header[0] & 0x80 == STREAM_HEADER:
+            reader, literal_length = BitReader(source), 9
+        else:
+            reader, literal_length = BitReader(source, self.__zeros_count(header)), 8
+        decoded = bytearray()
+        while reader.has_bits():
+            node = self.__traverse(reader)
+            if node is self.NYT:
+                sign = reader.read(literal_length)
+                if sign == END_OF_STREAM:
+                    break
+            else:
+                sign = node.sign
             decoded.append(sign)
             super().add_new_value(sign)
-            node = self.root
-            i = 8
-            while i < len(code):
-                if node:
-                    node = node.left if code[i] == '0' else node.right
-                    sign = node.sign if node else None
-                else:
-                    sign = None
+            if len(decoded) >= BUFFER_SIZE:
+                target.write(decoded)
+                decoded = bytearray()
+        target.write(decoded)
+
+    def __zeros_count(self, header):
+        return header[0] & 0x3f
+
+
+class VitterEncode(Encode, Vitter):
+    pass
+
+
+class VitterDecode(Decode, Vitter):
+    pass
+
+
+ENCODERS = {"fgk": Encode, "vitter": VitterEncode}
+DECODERS = {FGK.ENGINE: Decode, Vitter.ENGINE: VitterDecode}
+
 
-                if sign or sign == 0:
-                    if sign == 'NYT':
-                        sign = self.__get_sign_code(code[i + 1:i + 9])
-                        i += 8
-                    decoded.append(sign)
-                    super().add_new_value(sign)
-                    node = self.root
-                i += 1
-        decoded_file.write(bytes(bytearray(decoded)))
-        decoded_file.close()
+def header_engine(header):
+    if header & 0x80:
+        return header >> 6 & 1
+    return header & 0x0f
 
-    def __get_sign_code(self, binary):
-        return int(binary, 2)
 
-    def __remove_zeros(self, code):
-        zeros_count_info = '0' + code[1:8]
-        zero_count = int(zeros_count_info, 2)
-        bits = code[8:]
-        return bits[:-1 * zero_count]
+def is_container(header):
+    return header & 0xf0 == CONTAINER_HEADER
+
+
+def encode_block(block):
+    file_name, engine, offset, length = block
+    with open(file_name, "rb") as f:
+        f.seek(offset)
+        source = CountingStream(io.BytesIO(f.read(length)))
+    target = io.BytesIO()
+    ENCODERS[engine]().encode_stream(source, target)
+    return target.getvalue(), source.data
+
+
+def decode_block(payload):
+    target = io.BytesIO()
+    DECODERS[header_engine(payload[0])]().decode_stream(io.BytesIO(payload), target)
+    return target.getvalue()
+
+
+def map_blocks(function, blocks, processes):
+    """Maps function over blocks in order, on a pool of processes when there is more than one block."""
+    if len(blocks) > 1 and processes != 1:
+        with Pool(processes) as pool:
+            yield from pool.imap(function, blocks)
+    else:
+        yield from map(function, blocks)
+
+
+def encode_container(file_name, compressed_file, engine="fgk", block_size=BLOCK_SIZE, processes=None,
+                     input_data=None, output_data=None):
+    file_size = os.stat(file_name).st_size
+    blocks = [(file_name, engine, offset, min(block_size, file_size - offset))
+              for offset in range(0, file_size, block_size)]
+    index = []
+    with open(compressed_file, "wb") as file:
+        coded = CountingStream(file, output_data)
+        coded.write(pack(CONTAINER_FORMAT, CONTAINER_HEADER | ENCODERS[engine].ENGINE, block_size))
+        for block, (payload, block_data) in zip(blocks, map_blocks(encode_block, blocks, processes)):
+            if input_data is not None:
+                input_data.merge(block_data)
+            index.append((coded.tell(), len(payload), block[3]))
+            coded.write(payload)
+        index_offset = coded.tell()
+        for entry in index:
+            coded.write(pack(INDEX_ENTRY_FORMAT, *entry))
+        coded.write(pack(FOOTER_FORMAT, index_offset, len(index)))
+        return coded.tell() * 8
+
+
+def read_container_index(coded):
+    """Returns the block size and (offset, compressed length, length) of every block."""
+    coded.seek(0)
+    header, block_size = unpack(CONTAINER_FORMAT, coded.read(calcsize(CONTAINER_FORMAT)))
+    if not is_container(header):
+        raise ValueError("Plik nie jest kontenerem bloków.")
+    coded.seek(-calcsize(FOOTER_FORMAT), os.SEEK_END)
+    index_offset, count = unpack(FOOTER_FORMAT, coded.read(calcsize(FOOTER_FORMAT)))
+    coded.seek(index_offset)
+    entry_size = calcsize(INDEX_ENTRY_FORMAT)
+    index_data = coded.read(count * entry_size)
+    return block_size, [unpack(INDEX_ENTRY_FORMAT, index_data[i:i + entry_size])
+                        for i in range(0, len(index_data), entry_size)]
+
+
+def read_blocks(coded, entries):
+    for offset, compressed_length, _ in entries:
+        coded.seek(offset)
+        yield coded.read(compressed_length)
+
+
+def decode_container(coded, target, processes=None):
+    _, index = read_container_index(coded)
+    for decoded in map_blocks(decode_block, list(read_blocks(coded, index)), processes):
+        target.write(decoded)
+
+
+def extract_range(file_name, start, end, processes=None):
+    """Returns bytes [start, end) of the original file, decoding only the blocks covering them."""
+    with open(file_name, "rb") as coded:
+        block_size, index = read_container_index(coded)
+        first, last = start // block_size, (end - 1) // block_size
+        payloads = list(read_blocks(coded, index[first:last + 1]))
+    decoded = b"".join(map_blocks(decode_block, payloads, processes))
+    return decoded[start - first * block_size:end - first * block_size]
+
+
+def open_file(file_name, mode):
+    """Opens file_name, or returns stdin/stdout for '-'."""
+    if file_name != "-":
+        return open(file_name, mode)
+    return nullcontext(sys.stdin.buffer if "r" in mode else sys.stdout.buffer)
+
+
+def print_statistics(input_data, output_data, code_length):
+    print("Entropia: ", input_data.count_entropy())
+    print("Średnia długość kodowania: ", input_data.average_length(code_length))
+    print("Stopień kompresji: ", count_compress_ratio(input_data, output_data))
 
 
 def bad_parameters():
@@ -193,20 +377,41 @@ def bad_parameters():
 
 
 if __name__ == '__main__':
-    if len(sys.argv) == 4:
+    engine = "fgk"
+    block_size = BLOCK_SIZE
+    while len(sys.argv) > 4 and sys.argv[2] in ("--engine", "--block-size"):
+        if sys.argv[2] == "--engine":
+            engine = sys.argv[3]
+        else:
+            block_size = int(sys.argv[3])
+        del sys.argv[2:4]
+    if len(sys.argv) == 6 and sys.argv[1] == "-extract":
+        with open_file(sys.argv[3], "wb") as target:
+            target.write(extract_range(sys.argv[2], int(sys.argv[4]), int(sys.argv[5])))
+    elif len(sys.argv) == 4 and engine in ENCODERS and block_size > 0:
         flag = sys.argv[1]
         file_name = sys.argv[2]
         if flag == "-encode":
             compressed_file = sys.argv[3]
-            code = Encode().encode(file_name, compressed_file)
-            data = Data(file_name)
-            data.count_symbols()
-            print("Entropia: ", data.count_entropy())
-            print("Średnia długość kodowania: ", data.average_length(code, file_name))
-            print("Stopień kompresji: ", data.count_compress_ratio(file_name, compressed_file))
+            input_data, output_data = Data(), Data()
+            code_length = ENCODERS[engine]().encode(file_name, compressed_file, input_data, output_data)
+            print_statistics(input_data, output_data, code_length)
+        elif flag == "-encode-blocks":
+            compressed_file = sys.argv[3]
+            input_data, output_data = Data(), Data()
+            code_length = encode_container(file_name, compressed_file, engine, block_size,
+                                           input_data=input_data, output_data=output_data)
+            print_statistics(input_data, output_data, code_length)
+        elif flag == "-encode-stream":
+            with open_file(file_name, "rb") as source, open_file(sys.argv[3], "wb") as target:
+                ENCODERS[engine]().encode_stream(source, target)
         elif flag == "-decode":
-            decompressed_file = sys.argv[3]
-            Decode().decode(file_name, decompressed_file)
+            with open_file(file_name, "rb") as source, open_file(sys.argv[3], "wb") as target:
+                header = source.peek(1)[:1]
+                if header and is_container(header[0]):
+                    decode_container(source, target)
+                else:
+                    DECODERS[header_engine(header[0]) if header else FGK.ENGINE]().decode_stream(source, target)
         else:
             bad_parameters()
     else:
@@ -1,102 +1,173 @@
-import math
 import os
 import sys
-from struct import pack, unpack
+from struct import calcsize, pack, unpack
 
+from code_formats import FORMAT_IDS, FORMATS
+from dictionary_policies import CLEAR_CODE, DEFAULT_MAX_SIZE, END_OF_STREAM, POLICIES, POLICY_IDS
 
-class Data:
-    def __init__(self, file_name):
-        self.file_name = file_name
-        self.symbols_count = dict()
-        self.all_symbols = 0
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.bitio import BUFFER_SIZE, BitReader, BitWriter  # noqa: E402
+from common.stats import CountingStream, Data, count_compress_ratio  # noqa: E402
 
-    def count_symbols(self):
-        with open(self.file_name, "rb") as f:
-            file = f.read()
-            for index, value in enumerate(file):
-                self.symbols_count[value] = self.symbols_count.get(value, 0) + 1
-        self.all_symbols = os.stat(self.file_name).st_size
-
-    def count_entropy(self):
-        entropy = 0
-        for s in self.symbols_count.values():
-            entropy += (math.log2(s) - math.log2(self.all_symbols)) * (s / self.all_symbols)
-        if entropy != 0:
-            entropy *= -1
-        return entropy
+# Files in the original format (fixed codes, unbounded dictionary) have no
+# header and end with the file; all others start with magic, format id,
+# policy id and maximum dictionary size, and end with END_OF_STREAM.
+MAGIC = b"LZW"
+HEADER_FORMAT = "<3sBBI"
+HEADER_SIZE = calcsize(HEADER_FORMAT)
 
 
 class Coding:
-    def __init__(self, alphabet_size, save_file):
+    def __init__(self, alphabet_size, save_file, code_format="fixed", policy="none", max_size=DEFAULT_MAX_SIZE):
         self.symbols = dict()
-        self.alphabet = dict()
         self.alphabet_size = alphabet_size
+        # decoder entries: prefix code, last byte and length of the string
+        self.prefixes = []
+        self.lasts = []
+        self.lengths = []
         self.__init_symbols()
         self.code_length = 0
         self.save_file = save_file
+        self.code_format = code_format
+        self.policy = policy
+        self.max_size = max_size
 
     def __init_symbols(self):
-        for i in range(self.alphabet_size):
-            self.symbols[str(i)] = i
-            self.alphabet[i] = str(i)
-
-    def encode(self, file_name):
-        coded = open(self.save_file, 'wb')
-        i = self.alphabet_size
-        with open(file_name, "rb") as f:
-            file = f.read()
-            c = str(file[0])
-            for index, value in enumerate(file[1:]):
-                s = str(value)
-                concat = self.__concat(c, s)
-                if concat in self.symbols:
-                    c = concat
-                else:
-                    coded.write(pack('<I', self.symbols[c]))
+        self.prefixes[:] = [-1] * self.alphabet_size
+        self.lasts[:] = [i & 0xff for i in range(self.alphabet_size)]
+        self.lengths[:] = [1] * self.alphabet_size
+
+    def __has_header(self):
+        return self.code_format != "fixed" or self.policy != "none"
+
+    def encode(self, file_name, input_data=None, output_data=None):
+        """Codes file_name, counting its bytes into input_data and the written code into output_data."""
+        with open(self.save_file, 'wb') as coded, open(file_name, "rb") as f:
+            self.encode_stream(CountingStream(f, input_data), CountingStream(coded, output_data))
+
+    def encode_stream(self, source, coded):
+        """Codes source into coded, reading BUFFER_SIZE bytes at a time; neither stream has to be seekable."""
+        # symbols maps prefix_code << 8 | next_byte to the code of that string,
+        # entries maps codes back to their keys; a single byte is its own code
+        symbols = self.symbols
+        entries = dict()
+        code_format = FORMATS[self.code_format]()
+        policy = POLICIES[self.policy](self.alphabet_size, self.max_size)
+        if self.__has_header():
+            coded.write(pack(HEADER_FORMAT, MAGIC, FORMAT_IDS.index(self.code_format),
+                             POLICY_IDS.index(self.policy), self.max_size or 0))
+        writer = BitWriter(coded)
+        # c is the code of the string read so far, carried over from chunk to chunk;
+        # position is the index of the first byte of values in the whole input
+        c = None
+        position = 0
+        reset_byte, reset_bit = 0, 0
+        for chunk in iter(lambda: source.read(BUFFER_SIZE), b""):
+            values = memoryview(chunk)
+            if c is None:
+                c, values, position = values[0], values[1:], 1
+            for index, value in enumerate(values, position):
+                key = c << 8 | value
+                code = symbols.get(key)
+                if code is not None:
+                    c = code
+                    continue
+                code_format.write(writer, c, policy.max_code())
+                self.code_length += 1
+                policy.use(c)
+                if policy.should_reset(index - reset_byte, writer.bits_written - reset_bit):
+                    code_format.write(writer, CLEAR_CODE, policy.max_code())
                     self.code_length += 1
-                    self.symbols[concat] = i
-                    i += 1
-                    c = s
-            coded.write(pack('<I', self.symbols[c]))
-            self.code_length += 1
-        coded.close()
-
-    def decode(self, file_name):
-        decoded = open(self.save_file, 'w+b')
-        i = self.alphabet_size
-        file = []
-        with open(file_name, "rb") as f:
-            data = f.read(4)
-            while len(data) == 4:
-                (unpacked_data,) = unpack('<I', data)
-                file.append(unpacked_data)
-                data = f.read(4)
-
-
-            pk = int(file[0])
-            for code in file[1:]:
-                code = int(code)
-                pc = self.alphabet[pk]
-                if code in self.alphabet:
-                    first_symbol = self.alphabet[code].split(" ")[0]
+                    policy.reset()
+                    symbols.clear()
+                    entries.clear()
+                    reset_byte, reset_bit = index, writer.bits_written
                 else:
-                    first_symbol = pc.split(" ")[0]
-                self.alphabet[i] = self.__concat(pc, first_symbol)
-                i += 1
-                pk = int(code)
-        result = []
-        for code in file:
-            self.__print_decoded(self.alphabet[int(code)], result)
-        decoded.write(bytes(bytearray(result)))
-        decoded.close()
+                    slot = policy.add(c)
+                    if slot is not None:
+                        if slot in entries:
+                            del symbols[entries[slot]]
+                        symbols[key] = slot
+                        entries[slot] = key
+                c = value
+            position += len(values)
+        if c is not None:
+            code_format.write(writer, c, policy.max_code())
+            self.code_length += 1
+        if self.__has_header():
+            # the decoder reads it one entry ahead, as after any code but CLEAR_CODE
+            code_format.write(writer, END_OF_STREAM, policy.max_code(c is not None))
+            self.code_length += 1
+        writer.close()
 
-    def __concat(self, c, s):
-        return c + " " + s
+    def __read_header(self, f):
+        header = f.read(HEADER_SIZE)
+        if len(header) == HEADER_SIZE and header.startswith(MAGIC):
+            _, format_id, policy_id, self.max_size = unpack(HEADER_FORMAT, header)
+            self.code_format, self.policy = FORMAT_IDS[format_id], POLICY_IDS[policy_id]
+        else:
+            # files without a header hold fixed 4-byte codes up to the end of the file
+            self.code_format, self.policy = "fixed", "none"
+            f.seek(0)
 
-    def __print_decoded(self, c, result):
-        codes = c.split(" ")
-        for code in codes:
-            result.append(int(code))
+    def decode(self, file_name):
+        with open(file_name, "rb") as f, open(self.save_file, 'wb') as decoded_file:
+            self.decode_stream(f, decoded_file)
+
+    def decode_stream(self, f, decoded_file):
+        """Decodes f into decoded_file; only files without a header need f to be seekable."""
+        buffer = bytearray(BUFFER_SIZE)
+        decoded = bytearray()
+        self.__read_header(f)
+        code_format = FORMATS[self.code_format]()
+        policy = POLICIES[self.policy](self.alphabet_size, self.max_size)
+        reader = BitReader(f)
+        pk = None
+        while reader.has_bits():
+            code = code_format.read(reader, policy.max_code(pk is not None))
+            if code == END_OF_STREAM:
+                break
+            if code == CLEAR_CODE:
+                policy.reset()
+                self.__init_symbols()
+                pk = None
+                continue
+            i = policy.add(pk) if pk is not None else None
+            if i is not None and code == i:
+                # the code being defined right now: previous string + its first byte
+                self.__set_entry(i, pk, buffer[0])
+                length = self.__expand(code, buffer)
+            else:
+                length = self.__expand(code, buffer)
+                if i is not None:
+                    self.__set_entry(i, pk, buffer[0])
+            policy.use(code)
+            decoded += memoryview(buffer)[:length]
+            if len(decoded) >= BUFFER_SIZE:
+                decoded_file.write(decoded)
+                decoded.clear()
+            pk = code
+        decoded_file.write(decoded)
+
+    def __set_entry(self, code, prefix, last):
+        entry = (prefix, last, self.lengths[prefix] + 1)
+        if code < len(self.prefixes):
+            self.prefixes[code], self.lasts[code], self.lengths[code] = entry
+        else:
+            self.prefixes.append(prefix)
+            self.lasts.append(last)
+            self.lengths.append(entry[2])
+
+    def __expand(self, code, buffer):
+        """Writes the string of code into buffer, growing it when needed, and returns its length."""
+        length = self.lengths[code]
+        if length > len(buffer):
+            buffer.extend(bytes(length - len(buffer)))
+        prefixes, lasts = self.prefixes, self.lasts
+        for position in range(length - 1, -1, -1):
+            buffer[position] = lasts[code]
+            code = prefixes[code]
+        return length
 
 
 def bad_parameters():
@@ -104,22 +175,30 @@ def bad_parameters():
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 4:
+    code_format = "fixed"
+    policy = "none"
+    max_size = DEFAULT_MAX_SIZE
+    while len(sys.argv) > 4 and sys.argv[2] in ("--format", "--policy", "--max-size"):
+        if sys.argv[2] == "--format":
+            code_format = sys.argv[3]
+        elif sys.argv[2] == "--policy":
+            policy = sys.argv[3]
+        else:
+            max_size = int(sys.argv[3])
+        del sys.argv[2:4]
+    if len(sys.argv) == 4 and code_format in FORMATS and policy in POLICIES and 512 < max_size < 2 ** 32:
         flag = sys.argv[1]
         file_name = sys.argv[2]
         if flag == "-encode":
             compressed_file = sys.argv[3]
-            data_to_code = Data(file_name)
-            data_to_code.count_symbols()
+            data_to_code, coded_data = Data(), Data()
+            coding = Coding(512, compressed_file, code_format, policy, max_size)
+            coding.encode(file_name, data_to_code, coded_data)
             print("Entropia kodowanego tekstu: ", data_to_code.count_entropy())
             print("Długość kodowanego tekstu: ", data_to_code.all_symbols)
-            coding = Coding(512, compressed_file)
-            coding.encode(file_name)
-            coded_data = Data(compressed_file)
-            coded_data.count_symbols()
             print("Entropia kodu: ", coded_data.count_entropy())
-            print("Długość kodu: ", os.stat(compressed_file).st_size)
-            print("Stopień kompresji: ", (os.stat(file_name).st_size/os.stat(compressed_file).st_size))
+            print("Długość kodu: ", coded_data.all_symbols)
+            print("Stopień kompresji: ", count_compress_ratio(data_to_code, coded_data))
         elif flag == "-decode":
             decompressed_file = sys.argv[3]
             coding = Coding(512, decompressed_file)
@@ -1,41 +1,107 @@
+import json
 import math
+import os
+import sys
+from multiprocessing import Pool, shared_memory
+from struct import calcsize, pack, unpack
 from sys import argv
-from collections import defaultdict
 
+import numpy as np
 
-class Pixel:
-    def __init__(self, red=0, green=0, blue=0):
-        self.red = red
-        self.green = green
-        self.blue = blue
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import tga  # noqa: E402
+from common.tga import CHANNEL_OFFSETS, COLORS, channel_histograms  # noqa: E402
+from common.stats import entropy  # noqa: E402
+from loco_i import decode_planes, encode_planes  # noqa: E402
 
-    def __add__(self, other):
-        return Pixel(red=self.red + other.red, green=self.green + other.green, blue=self.blue + other.blue)
+# a compressed file starts with MAGIC, the image size and the length of the
+# TGA image id, followed by the id and the LOCO-I bitstream of the blue,
+# green and red planes
+MAGIC = b"LOCO"
+HEADER_FORMAT = "<4sHHB"
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+# rows per strip in streaming mode
+STRIP_HEIGHT = 16
+# side of the square blocks that pick their own schema in adaptive mode
+BLOCK_SIZE = 16
+ADAPTIVE_PASSES = 2
+ENTROPY_NAMES = ("all", "red", "green", "blue")
 
-    def __sub__(self, other):
-        return Pixel(red=self.red - other.red, green=self.green - other.green, blue=self.blue - other.blue)
 
-    def __floordiv__(self, num):
-        return Pixel(red=self.red // num, green=self.green // num, blue=self.blue // num)
+def median_prediction(n, w, nw):
+    """LOCO-I median predictor; like the other schemas it compares whole pixels by the sum of their channels."""
+    n_sum, w_sum, nw_sum = (pixels[..., 0] + pixels[..., 1] + pixels[..., 2] for pixels in (n, w, nw))
+    above = nw_sum >= np.maximum(n_sum, w_sum)
+    below = ~above & (nw_sum <= np.minimum(n_sum, w_sum))
+    prediction = w + n - nw
+    np.copyto(prediction, w, where=(above | below)[..., None])
+    np.copyto(prediction, n, where=(above & (n_sum > w_sum) | below & (n_sum < w_sum))[..., None])
+    return prediction
 
-    def __lt__(self, other):
-        return (self.red + self.green + self.blue) < (other.red + other.green + other.blue)
 
-    def __le__(self, other):
-        return (self.red + self.green + self.blue) <= (other.red + other.green + other.blue)
+PREDICTIONS = [
+    lambda n, w, nw: w,
+    lambda n, w, nw: n,
+    lambda n, w, nw: nw,
+    lambda n, w, nw: n + w - nw,
+    lambda n, w, nw: n + (w - nw) // 2,
+    lambda n, w, nw: w + (n - nw) // 2,
+    lambda n, w, nw: (n + w) // 2,
+    median_prediction
+]
 
-    def __gt__(self, other):
-        return (self.red + self.green + self.blue) > (other.red + other.green + other.blue)
 
-    def __ge__(self, other):
-        return (self.red + self.green + self.blue) >= (other.red + other.green + other.blue)
+def neighbours(bitmap, above=None):
+    """Returns the n, w and nw neighbours of every pixel.
 
-    def __mod__(self, modulo):
-        return Pixel(
-            red=self.red % modulo,
-            green=self.green % modulo,
-            blue=self.blue % modulo
-        )
+    Pixels outside the image are 0; above is the row over the first row of
+    bitmap when bitmap is a strip of a larger image.
+    """
+    height, width, _ = bitmap.shape
+    framed = np.zeros((height + 1, width + 1, 3), dtype=np.int16)
+    framed[1:, 1:] = bitmap
+    if above is not None:
+        framed[0, 1:] = above
+    return framed[:-1, 1:], framed[1:, :-1], framed[:-1, :-1]
+
+
+def stream_histograms(bitmap, strip_height=STRIP_HEIGHT):
+    """Counts the histograms of bitmap and of the residuals of every schema strip by strip.
+
+    Only one strip and the row above it are held at a time, so memory grows
+    with the width of the image, not with its size.
+    """
+    histograms = [Entropy() for _ in range(len(PREDICTIONS) + 1)]
+    above = None
+    for top in range(0, len(bitmap), strip_height):
+        strip = bitmap[top:top + strip_height]
+        histograms[0].update(strip)
+        pixel_neighbours = neighbours(strip, above)
+        for histogram, prediction in zip(histograms[1:], PREDICTIONS):
+            histogram.update(residual(strip, prediction, pixel_neighbours))
+        above = strip[-1]
+    return histograms
+
+
+def residual(bitmap, prediction, pixel_neighbours=None, out=None):
+    """Returns the residuals of one schema modulo 256 as a uint8 array shaped like bitmap."""
+    n, w, nw = pixel_neighbours or neighbours(bitmap)
+    if out is None:
+        out = np.empty(bitmap.shape, dtype=np.uint8)
+    # the unsafe cast to uint8 wraps the difference modulo 256
+    return np.subtract(bitmap, prediction(n, w, nw), out=out, dtype=np.int16, casting="unsafe")
+
+
+def block_sums(values, block_size):
+    """Sums (height, width, 3) values over square blocks; blocks at the bottom and right edges may be smaller."""
+    height, width, _ = values.shape
+    blocks_down, blocks_across = -(-height // block_size), -(-width // block_size)
+    if height % block_size or width % block_size:
+        padded = np.zeros((blocks_down * block_size, blocks_across * block_size, 3), dtype=values.dtype)
+        padded[:height, :width] = values
+        values = padded
+    row_sums = values.reshape(blocks_down, block_size, -1, 3).sum(axis=1)
+    return row_sums.reshape(blocks_down, blocks_across, block_size, 3).sum(axis=2)
 
 
 class JpegLsEncoder:
@@ -43,79 +109,150 @@ class JpegLsEncoder:
         self.width = None
         self.height = None
         self.bitmap = self.__get_bitmap(filename)
-        self.predictions = [
-            lambda n, w, nw: w,
-            lambda n, w, nw: n,
-            lambda n, w, nw: nw,
-            lambda n, w, nw: n + w - nw,
-            lambda n, w, nw: n + (w - nw) // 2,
-            lambda n, w, nw: w + (n - nw) // 2,
-            lambda n, w, nw: (n + w) // 2,
-            lambda n, w, nw: max(w, n) if nw >= max(w, n) else min(w, n) if nw <= min(w, n) else w + n - nw
-        ]
+        self.predictions = PREDICTIONS
         self.best_all_entropy = {}
         self.best_red_entropy = {}
         self.best_green_entropy = {}
         self.best_blue_entropy = {}
 
     def __get_bitmap(self, filename):
-        with open(filename, "rb") as f:
-            image = f.read()
-        self.width = image[13] * 256 + image[12]
-        self.height = image[15] * 256 + image[14]
-        image = image[18:]
-        result = []
-        for i in range(self.height):
-            row = []
-            for j in range(self.width):
-                index = 3 * (i * self.width + j)
-                row.append(Pixel(red=image[index + 2], green=image[index + 1], blue=image[index]))
-            result.insert(0, row)
-        return result
-
-    def __jpeg_ls(self, prediction):
-        frame_pixel = Pixel(0, 0, 0)
-        encoded = []
-        for i in range(self.height):
-            encoded_row = []
-            for j in range(self.width):
-                if i == 0:
-                    n = frame_pixel
-                else:
-                    n = self.bitmap[i - 1][j]
-                if j == 0:
-                    w = frame_pixel
-                else:
-                    w = self.bitmap[i][j - 1]
-
-                if i == 0 or j == 0:
-                    nw = frame_pixel
-                else:
-                    nw = self.bitmap[i - 1][j - 1]
-                encoded_row.append((self.bitmap[i][j] - prediction(n, w, nw)) % 256)
-
-            encoded.append(encoded_row)
+        image = tga.read(filename)
+        self.image_id = image.image_id
+        self.width = image.width
+        self.height = image.height
+        return image.pixels
 
+    def residuals(self):
+        """Returns the residuals of all schemas as a (schemas, height, width, 3) array."""
+        pixel_neighbours = neighbours(self.bitmap)
+        bitmap = self.bitmap.astype(np.int16)
+        encoded = np.empty((len(self.predictions), self.height, self.width, 3), dtype=np.uint8)
+        for i, prediction in enumerate(self.predictions):
+            residual(bitmap, prediction, pixel_neighbours, encoded[i])
         return encoded
 
     def encode(self):
         print('Image entropy:')
-        self.print_entropies(self.bitmap)
+        self.print_entropies(Entropy(self.bitmap))
 
-        for i, schema in enumerate(self.predictions):
+        for i, encoded in enumerate(self.residuals()):
             print(f"Schema {i+1} entropy:")
-            self.print_entropies(self.__jpeg_ls(schema), i+1)
+            self.print_entropies(Entropy(encoded), i+1)
+
+    def encode_streaming(self, strip_height=STRIP_HEIGHT):
+        """Prints the same entropies as encode without holding the residuals of the whole image."""
+        image_histograms, *schema_histograms = stream_histograms(self.bitmap, strip_height)
+        print('Image entropy:')
+        self.print_entropies(image_histograms)
+
+        for i, histograms in enumerate(schema_histograms):
+            print(f"Schema {i+1} entropy:")
+            self.print_entropies(histograms, i+1)
+
+    def adaptive_residuals(self, residuals, histograms, block_size=BLOCK_SIZE, pooled=False):
+        """Picks the schema with the shortest code for every block and channel.
+
+        Starting from the best global schemas, every pass prices the residuals
+        of all schemas with the code lengths of the histograms of the current
+        picks, sums them per block and picks the cheapest schema again, which
+        never makes the entropy worse. A block only leaves its schema for a
+        strictly cheaper one, and a channel whose entropy and map together
+        still come out above its best global schema falls back to it, so the
+        adaptive total never exceeds the global one. With pooled the three
+        channels share one histogram, as in the "all" entropy. residuals and
+        their histograms come from residuals() and are shared by all passes.
+
+        Returns the (blocks down, blocks across, 3) map of picked schema
+        indices and the residuals of the image coded with them.
+        """
+        if pooled:
+            best = [min(range(len(residuals)), key=lambda i: histograms[i].count_entropy())] * 3
+        else:
+            best = [min(range(len(residuals)), key=lambda i: histograms[i].count_entropy(color)) for color in COLORS]
+        schema_map = np.empty((-(-self.height // block_size), -(-self.width // block_size), 3), dtype=np.uint8)
+        schema_map[:] = best
+        costs = np.empty((len(residuals),) + schema_map.shape, dtype=np.float32)
+        for _ in range(ADAPTIVE_PASSES):
+            counts = Entropy(self.__pick_residuals(residuals, schema_map, block_size)).pixels_count
+            if pooled:
+                counts = np.broadcast_to(counts.sum(axis=0), counts.shape)
+            lengths = -np.log2(np.maximum(counts, 1) / counts.sum(axis=1, keepdims=True)).astype(np.float32)
+            for i, encoded in enumerate(residuals):
+                costs[i] = block_sums(lengths.ravel()[np.add(encoded, CHANNEL_OFFSETS, dtype=np.uint16)], block_size)
+            current = np.take_along_axis(costs, schema_map[None].astype(np.intp), axis=0)[0]
+            schema_map = np.where(costs.min(axis=0) < current, costs.argmin(axis=0), schema_map).astype(np.uint8)
+        encoded = self.__pick_residuals(residuals, schema_map, block_size)
+        adaptive_histograms, map_histograms = Entropy(encoded), Entropy(schema_map)
+        scale = schema_map.shape[0] * schema_map.shape[1] / (self.width * self.height)
+        if pooled:
+            if adaptive_histograms.count_entropy() + map_histograms.count_entropy() * scale \
+                    > histograms[best[0]].count_entropy():
+                schema_map[:] = best
+        else:
+            for color, channel in COLORS.items():
+                if adaptive_histograms.count_entropy(color) + map_histograms.count_entropy(color) * scale \
+                        > histograms[best[channel]].count_entropy(color):
+                    schema_map[..., channel] = best[channel]
+        return schema_map, self.__pick_residuals(residuals, schema_map, block_size)
+
+    def __pick_residuals(self, residuals, schema_map, block_size):
+        choice = schema_map.repeat(block_size, axis=0)[:self.height].repeat(block_size, axis=1)[:, :self.width]
+        encoded = residuals[0].copy()
+        for i in range(1, len(residuals)):
+            np.copyto(encoded, residuals[i], where=choice == i)
+        return encoded
+
+    def print_adaptive_entropies(self, block_size=BLOCK_SIZE):
+        """Compares the entropies of per-block schemas, with the cost of their map, to the best global schemas."""
+        residuals = self.residuals()
+        histograms = [Entropy(encoded) for encoded in residuals]
+        for i, schema_histograms in enumerate(histograms):
+            self.count_entropies(schema_histograms, i+1)
+        # bits per value needed to code a map with an entropy coder
+        scale = math.ceil(self.height / block_size) * math.ceil(self.width / block_size) / (self.width * self.height)
+        print(f"Block size: {block_size}")
+        schema_map, encoded = self.adaptive_residuals(residuals, histograms, block_size, pooled=True)
+        adaptive_entropy = Entropy(encoded).count_entropy()
+        side_information = Entropy(schema_map).count_entropy() * scale
+        self.__print_adaptive_entropy("all", adaptive_entropy, side_information, self.best_all_entropy)
+        schema_map, encoded = self.adaptive_residuals(residuals, histograms, block_size)
+        adaptive_histograms, map_histograms = Entropy(encoded), Entropy(schema_map)
+        for color, best in (("red", self.best_red_entropy), ("green", self.best_green_entropy),
+                            ("blue", self.best_blue_entropy)):
+            self.__print_adaptive_entropy(color, adaptive_histograms.count_entropy(color),
+                                          map_histograms.count_entropy(color) * scale, best)
+
+    def __print_adaptive_entropy(self, name, adaptive_entropy, side_information, best):
+        print(f"Adaptive {name} entropy: {adaptive_entropy} + map {side_information} = "
+              f"{adaptive_entropy + side_information}, best global entropy: {best['entropy']}, "
+              f"schema: {best['schema']}")
+
+    def compress(self, compressed_file):
+        """Writes the image coded with LOCO-I; returns the number of bits of every color."""
+        planes = [[row.tobytes() for row in self.bitmap[..., channel]] for channel in COLORS.values()]
+        with open(compressed_file, "wb") as f:
+            f.write(pack(HEADER_FORMAT, MAGIC, self.width, self.height, len(self.image_id)) + self.image_id)
+            bits = encode_planes(f, planes, self.width)
+        return dict(zip(COLORS, bits))
 
-    def print_entropies(self, bitmap, schema=None):
-        all_entropy = Entropy().count_entropy(bitmap)
-        red_entropy = Entropy("red").count_entropy(bitmap)
-        blue_entropy = Entropy("blue").count_entropy(bitmap)
-        green_entropy = Entropy("green").count_entropy(bitmap)
+    def count_best_entropies(self):
+        for i, histograms in enumerate(stream_histograms(self.bitmap)[1:]):
+            self.count_entropies(histograms, i+1)
+
+    def count_entropies(self, histograms, schema=None):
+        all_entropy = histograms.count_entropy()
+        red_entropy = histograms.count_entropy("red")
+        blue_entropy = histograms.count_entropy("blue")
+        green_entropy = histograms.count_entropy("green")
         if schema:
             self.best_all_entropy = self.__best_entropy(self.best_all_entropy, all_entropy, schema)
             self.best_red_entropy = self.__best_entropy(self.best_red_entropy, red_entropy, schema)
             self.best_green_entropy = self.__best_entropy(self.best_green_entropy, green_entropy, schema)
             self.best_blue_entropy = self.__best_entropy(self.best_blue_entropy, blue_entropy, schema)
+        return all_entropy, red_entropy, green_entropy, blue_entropy
+
+    def print_entropies(self, histograms, schema=None):
+        all_entropy, red_entropy, green_entropy, blue_entropy = self.count_entropies(histograms, schema)
         print(f"all: {all_entropy}")
         print(f"red: {red_entropy}")
         print(f"green: {green_entropy}")
@@ -134,35 +271,130 @@ class JpegLsEncoder:
             f"Best green entropy: {self.best_green_entropy['entropy']}, schema: {self.best_green_entropy['schema']}")
         print(f"Best blue entropy: {self.best_blue_entropy['entropy']}, schema: {self.best_blue_entropy['schema']}")
 
+    def print_compression(self, bits):
+        """Compares the bits per value of LOCO-I with the best schema entropies."""
+        values = self.width * self.height
+        print(f"LOCO-I all: {sum(bits.values()) / (3 * values)} bits per value, "
+              f"best entropy: {self.best_all_entropy['entropy']}")
+        for color, best in (("red", self.best_red_entropy), ("green", self.best_green_entropy),
+                            ("blue", self.best_blue_entropy)):
+            print(f"LOCO-I {color}: {bits[color] / values} bits per value, best entropy: {best['entropy']}")
+
 
 class Entropy:
-    def __init__(self, color=None):
-        self.color = color
-        self.pixels_count = defaultdict(int)
+    """Histograms of the three channels of (height, width, 3) bitmaps; the combined histogram is their sum."""
+
+    def __init__(self, bitmap=None):
+        self.pixels_count = np.zeros((3, 256), dtype=np.int64)
         self.all_pixels = 0
+        if bitmap is not None:
+            self.update(bitmap)
+
+    def update(self, bitmap):
+        self.pixels_count += channel_histograms(bitmap)
+        self.all_pixels += bitmap.size // 3
+
+    def count_entropy(self, color=None):
+        if color:
+            return entropy(self.pixels_count[COLORS[color]].tolist(), self.all_pixels)
+        return entropy(self.pixels_count.sum(axis=0).tolist(), 3 * self.all_pixels)
+
+
+def share_bitmap(filename):
+    """Copies the pixels of filename into a new shared memory block; returns the block and the bitmap shape."""
+    bitmap = JpegLsEncoder(filename).bitmap
+    memory = shared_memory.SharedMemory(create=True, size=max(bitmap.nbytes, 1))
+    np.ndarray(bitmap.shape, dtype=np.uint8, buffer=memory.buf)[:] = bitmap
+    return memory, bitmap.shape
+
+
+def evaluate_schema(task):
+    """Counts the entropies of one schema of an image in shared memory; schema 0 is the image itself."""
+    filename, memory_name, shape, schema = task
+    memory = shared_memory.SharedMemory(memory_name)
+    try:
+        bitmap = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        histograms = Entropy(residual(bitmap, PREDICTIONS[schema - 1]) if schema else bitmap)
+        del bitmap
+    finally:
+        memory.close()
+    entropies = {"all": histograms.count_entropy()}
+    entropies.update({color: histograms.count_entropy(color) for color in ENTROPY_NAMES[1:]})
+    return filename, schema, entropies
+
+
+def image_report(filename, shape, entropies):
+    schemas = [dict(schema=schema, **entropies[schema]) for schema in range(1, len(PREDICTIONS) + 1)]
+    # like __best_entropy, the first of equally good schemas wins
+    best = {name: min(({"entropy": entry[name], "schema": entry["schema"]} for entry in schemas),
+                      key=lambda entry: entry["entropy"])
+            for name in ENTROPY_NAMES}
+    return {"file": filename, "width": shape[1], "height": shape[0], "image": entropies[0], "schemas": schemas,
+            "best": best}
+
+
+def evaluate_batch(filenames, processes=None):
+    """Spreads every (image, schema) pair over a pool of processes that read the images from shared memory."""
+    memories, shapes, tasks = {}, {}, []
+    results = {filename: {} for filename in filenames}
+    try:
+        for filename in results:
+            memories[filename], shapes[filename] = share_bitmap(filename)
+            tasks += [(filename, memories[filename].name, shapes[filename], schema)
+                      for schema in range(len(PREDICTIONS) + 1)]
+        with Pool(processes) as pool:
+            for filename, schema, entropies in pool.imap_unordered(evaluate_schema, tasks):
+                results[filename][schema] = entropies
+    finally:
+        for memory in memories.values():
+            memory.close()
+            memory.unlink()
+    return [image_report(filename, shapes[filename], results[filename]) for filename in results]
+
+
+def batch(report_file, filenames):
+    reports = evaluate_batch(filenames)
+    with open(report_file, "w") as f:
+        json.dump({"images": reports}, f, indent=2)
+    for report in reports:
+        print(report["file"])
+        for name in ENTROPY_NAMES:
+            print(f"Best {name} entropy: {report['best'][name]['entropy']}, schema: {report['best'][name]['schema']}")
+        print()
+
 
-    def count_entropy(self, bitmap):
-        entropy = 0
-        for r in bitmap:
-            for pixel in r:
-                if self.color:
-                    value = getattr(pixel, self.color)
-                    self.pixels_count[value] += 1
-                    self.all_pixels += 1
-                else:
-                    self.pixels_count[pixel.red] += 1
-                    self.pixels_count[pixel.green] += 1
-                    self.pixels_count[pixel.blue] += 1
-                    self.all_pixels += 3
-        for s in self.pixels_count.values():
-            entropy += (math.log2(s) - math.log2(self.all_pixels)) * (s / self.all_pixels)
-        if entropy != 0:
-            entropy *= -1
-        return entropy
+def decompress(compressed_file, decompressed_file):
+    with open(compressed_file, "rb") as f:
+        header = f.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or not header.startswith(MAGIC):
+            raise ValueError(f"{compressed_file} is not a LOCO-I file")
+        _, width, height, id_length = unpack(HEADER_FORMAT, header)
+        image_id = f.read(id_length)
+        planes = decode_planes(f, width, height, len(COLORS))
+    bitmap = np.stack([np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(height, width) for rows in planes],
+                      axis=-1)
+    tga.write(decompressed_file, bitmap, image_id)
 
 
 if __name__ == "__main__":
-    filename = argv[1]
-    encoder = JpegLsEncoder(filename)
-    encoder.encode()
-    encoder.print_best_entropies()
+    if len(argv) == 4 and argv[1] == "-encode":
+        encoder = JpegLsEncoder(argv[2])
+        bits = encoder.compress(argv[3])
+        encoder.count_best_entropies()
+        encoder.print_compression(bits)
+    elif len(argv) == 4 and argv[1] == "-decode":
+        decompress(argv[2], argv[3])
+    elif len(argv) > 3 and argv[1] == "-batch":
+        batch(argv[2], argv[3:])
+    elif len(argv) in (3, 4) and argv[1] == "-adaptive":
+        encoder = JpegLsEncoder(argv[2])
+        encoder.print_adaptive_entropies(*map(int, argv[3:]))
+    elif len(argv) == 3 and argv[1] == "-stream":
+        encoder = JpegLsEncoder(argv[2])
+        encoder.encode_streaming()
+        encoder.print_best_entropies()
+    else:
+        filename = argv[1]
+        encoder = JpegLsEncoder(filename)
+        encoder.encode()
+        encoder.print_best_entropies()
@@ -0,0 +1,289 @@
+"""LOCO-I, the lossless mode of JPEG-LS, for 8-bit image planes.
+
+Every plane is coded on its own, row by row, from the causal neighbours
+a (west), b (north), c (north-west) and d (north-east) of each value:
+
+- the three local gradients d - b, b - c and c - a are quantized to one of
+  365 contexts (merged with their sign-reversed counterparts),
+- the median predictor is corrected by the bias C accumulated in the context,
+- the residual is coded with a Golomb-Rice code whose parameter k follows
+  the mean absolute residual A / N of the context,
+- when all gradients are 0 the coder switches to run mode and codes the
+  length of the run of values equal to a with the adaptive J table.
+
+Both sides update the same state from the same values, so decoding needs
+nothing but the bitstream and the plane size.
+"""
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.bitio import BitReader, BitWriter  # noqa: E402
+
+MAX_VALUE = 255
+RANGE = MAX_VALUE + 1
+QBPP = 8
+LIMIT = 32
+RESET = 64
+T1, T2, T3 = 3, 7, 21
+MIN_C, MAX_C = -128, 127
+# 365 regular contexts, followed by the two run interruption contexts
+CONTEXTS = 365
+RUN_CONTEXTS = 2
+A_INIT = max(2, (RANGE + 32) // 64)
+J = [0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 9, 10, 11, 12, 13, 14, 15]
+
+
+def quantize_gradient(d):
+    if d <= -T3:
+        return -4
+    if d <= -T2:
+        return -3
+    if d <= -T1:
+        return -2
+    if d < 0:
+        return -1
+    if d == 0:
+        return 0
+    if d < T1:
+        return 1
+    if d < T2:
+        return 2
+    if d < T3:
+        return 3
+    return 4
+
+
+# QUANTIZED[d + MAX_VALUE] is the quantized gradient d
+QUANTIZED = [quantize_gradient(d) for d in range(-MAX_VALUE, MAX_VALUE + 1)]
+
+
+def median_prediction(a, b, c):
+    if c >= max(a, b):
+        return min(a, b)
+    if c <= min(a, b):
+        return max(a, b)
+    return a + b - c
+
+
+class LocoI:
+    """Context state of one plane; encode_plane and decode_plane drive it the same way."""
+
+    def __init__(self):
+        self.a = [A_INIT] * (CONTEXTS + RUN_CONTEXTS)
+        self.b = [0] * CONTEXTS
+        self.c = [0] * CONTEXTS
+        self.n = [1] * (CONTEXTS + RUN_CONTEXTS)
+        # negative residuals per run interruption context
+        self.nn = [0] * RUN_CONTEXTS
+        self.run_index = 0
+
+    def __context(self, a, b, c, d):
+        """Returns the context and the sign of the gradients, or (0, 1) in run mode."""
+        q = (QUANTIZED[d - b + MAX_VALUE] * 9 + QUANTIZED[b - c + MAX_VALUE]) * 9 + QUANTIZED[c - a + MAX_VALUE]
+        return (-q, -1) if q < 0 else (q, 1)
+
+    def __prediction(self, q, sign, a, b, c):
+        prediction = median_prediction(a, b, c) + sign * self.c[q]
+        return min(max(prediction, 0), MAX_VALUE)
+
+    def __k(self, q, a):
+        n = self.n[q]
+        k = 0
+        while n << k < a:
+            k += 1
+        return k
+
+    def __update(self, q, error):
+        a, b, c, n = self.a, self.b, self.c, self.n
+        b[q] += error
+        a[q] += abs(error)
+        if n[q] == RESET:
+            a[q] >>= 1
+            b[q] >>= 1
+            n[q] >>= 1
+        n[q] += 1
+        # bias correction keeps b[q] / n[q] in (-1, 0]
+        if b[q] <= -n[q]:
+            b[q] += n[q]
+            if c[q] > MIN_C:
+                c[q] -= 1
+            if b[q] <= -n[q]:
+                b[q] = -n[q] + 1
+        elif b[q] > 0:
+            b[q] -= n[q]
+            if c[q] < MAX_C:
+                c[q] += 1
+            if b[q] > 0:
+                b[q] = 0
+
+    def __run_k(self, q, run_type):
+        return self.__k(q, self.a[q] + (self.n[q] >> 1) if run_type else self.a[q])
+
+    def __update_run(self, q, run_type, error, mapped):
+        if error < 0:
+            self.nn[q - CONTEXTS] += 1
+        self.a[q] += (mapped + 1 - run_type) >> 1
+        if self.n[q] == RESET:
+            self.a[q] >>= 1
+            self.n[q] >>= 1
+            self.nn[q - CONTEXTS] >>= 1
+        self.n[q] += 1
+
+    def __swap_sign(self, q, k):
+        """Tells whether run interruption residuals of this context map negative values first."""
+        return k == 0 and 2 * self.nn[q - CONTEXTS] < self.n[q]
+
+    @staticmethod
+    def __write_code(writer, mapped, k, limit):
+        """Limited-length Golomb-Rice code: unary mapped >> k and k low bits, or an escape and QBPP bits."""
+        high = mapped >> k
+        if high < limit - QBPP - 1:
+            writer.write(1 << k | mapped & ((1 << k) - 1), high + 1 + k)
+        else:
+            writer.write(1 << QBPP | mapped - 1, limit)
+
+    @staticmethod
+    def __read_code(reader, k, limit):
+        high = 0
+        while not reader.read_bit():
+            high += 1
+        if high < limit - QBPP - 1:
+            return high << k | reader.read(k)
+        return reader.read(QBPP) + 1
+
+    def encode_plane(self, writer, rows, width):
+        """Codes rows, a sequence of width-byte rows of the plane from the top."""
+        # above[j + 1] is the value north of column j; above[0] is c of column 0
+        # and above[width + 1] repeats the last value as d of the last column
+        above = [0] * (width + 2)
+        for row in rows:
+            j = 0
+            while j < width:
+                b, c, d = above[j + 1], above[j], above[j + 2]
+                a = row[j - 1] if j else b
+                q, sign = self.__context(a, b, c, d)
+                if q:
+                    prediction = self.__prediction(q, sign, a, b, c)
+                    error = ((sign * (row[j] - prediction) + 128) & 0xff) - 128
+                    k = self.__k(q, self.a[q])
+                    if k == 0 and 2 * self.b[q] <= -self.n[q]:
+                        mapped = 2 * error + 1 if error >= 0 else -2 * (error + 1)
+                    else:
+                        mapped = 2 * error if error >= 0 else -2 * error - 1
+                    self.__write_code(writer, mapped, k, LIMIT)
+                    self.__update(q, error)
+                    j += 1
+                    continue
+                # run mode
+                run = j
+                while run < width and row[run] == a:
+                    run += 1
+                count = run - j
+                while count >= 1 << J[self.run_index]:
+                    writer.write(1, 1)
+                    count -= 1 << J[self.run_index]
+                    self.run_index = min(self.run_index + 1, len(J) - 1)
+                if run == width:
+                    if count:
+                        writer.write(1, 1)
+                    break
+                writer.write(count, 1 + J[self.run_index])
+                self.__encode_interruption(writer, row[run], a, above[run + 1])
+                j = run + 1
+            above = [above[1]] + list(row) + [row[-1]]
+
+    def __encode_interruption(self, writer, x, a, b):
+        run_type = int(a == b)
+        q = CONTEXTS + run_type
+        error = x - (a if run_type else b)
+        if not run_type and a > b:
+            error = -error
+        error = ((error + 128) & 0xff) - 128
+        k = self.__run_k(q, run_type)
+        if error > 0 and self.__swap_sign(q, k) or error < 0 and not self.__swap_sign(q, k):
+            swap = 1
+        else:
+            swap = 0
+        mapped = 2 * abs(error) - run_type - swap
+        self.__write_code(writer, mapped, k, LIMIT - J[self.run_index] - 1)
+        self.__update_run(q, run_type, error, mapped)
+        self.run_index = max(self.run_index - 1, 0)
+
+    def decode_plane(self, reader, width, height):
+        """Returns the plane as a list of height arrays of width values."""
+        rows = []
+        above = [0] * (width + 2)
+        for i in range(height):
+            row = array('B', bytes(width))
+            j = 0
+            while j < width:
+                b, c, d = above[j + 1], above[j], above[j + 2]
+                a = row[j - 1] if j else b
+                q, sign = self.__context(a, b, c, d)
+                if q:
+                    prediction = self.__prediction(q, sign, a, b, c)
+                    k = self.__k(q, self.a[q])
+                    mapped = self.__read_code(reader, k, LIMIT)
+                    if k == 0 and 2 * self.b[q] <= -self.n[q]:
+                        error = (mapped - 1) >> 1 if mapped & 1 else -(mapped >> 1) - 1
+                    else:
+                        error = -((mapped + 1) >> 1) if mapped & 1 else mapped >> 1
+                    row[j] = (prediction + sign * error) & 0xff
+                    self.__update(q, error)
+                    j += 1
+                    continue
+                # run mode
+                interrupted = False
+                while j < width:
+                    if not reader.read_bit():
+                        interrupted = True
+                        break
+                    length = 1 << J[self.run_index]
+                    end = min(j + length, width)
+                    row[j:end] = array('B', [a]) * (end - j)
+                    if end - j == length:
+                        self.run_index = min(self.run_index + 1, len(J) - 1)
+                    j = end
+                if not interrupted:
+                    break
+                count = reader.read(J[self.run_index])
+                row[j:j + count] = array('B', [a]) * count
+                j += count
+                row[j] = self.__decode_interruption(reader, a, above[j + 1])
+                j += 1
+            rows.append(row)
+            above = [above[1]] + list(row) + [row[-1]]
+        return rows
+
+    def __decode_interruption(self, reader, a, b):
+        run_type = int(a == b)
+        q = CONTEXTS + run_type
+        k = self.__run_k(q, run_type)
+        mapped = self.__read_code(reader, k, LIMIT - J[self.run_index] - 1)
+        swap = (mapped + run_type) & 1
+        magnitude = (mapped + run_type + swap) >> 1
+        error = magnitude if swap == self.__swap_sign(q, k) else -magnitude
+        self.__update_run(q, run_type, error, mapped)
+        self.run_index = max(self.run_index - 1, 0)
+        if not run_type and a > b:
+            error = -error
+        return ((a if run_type else b) + error) & 0xff
+
+
+def encode_planes(stream, planes, width):
+    """Codes planes, each a sequence of rows, into stream; returns the number of bits of every plane."""
+    writer = BitWriter(stream)
+    bits = []
+    for rows in planes:
+        start = writer.bits_written
+        LocoI().encode_plane(writer, rows, width)
+        bits.append(writer.bits_written - start)
+    writer.close()
+    return bits
+
+
+def decode_planes(stream, width, height, count):
+    reader = BitReader(stream)
+    return [LocoI().decode_plane(reader, width, height) for _ in range(count)]
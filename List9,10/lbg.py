@@ -0,0 +1,172 @@
+"""LBG (generalized Lloyd) training of color codebooks.
+
+Training works on the distinct colors of an image weighted by how often
+they occur, so its cost depends on the number of colors, not pixels. The
+codebook starts as the mean color and doubles by splitting every codeword
+in two, each size refined with Lloyd iterations until the distortion stops
+improving.
+
+Nearest codewords are found through a ColorTree, a KD-tree over the colors,
+instead of comparing every color with every codeword.
+"""
+import math
+
+import numpy as np
+
+SPLIT_OFFSET = 1.0
+MAX_ITERATIONS = 20
+THRESHOLD = 1e-3
+MIN_LEAF_SIZE = 32
+MAX_LEAVES = 1 << 14
+LEAVES_PER_GROUP = 32
+# largest number of (color, codeword) pairs compared at once
+CHUNK_SIZE = 1 << 20
+
+
+def color_histogram(pixels):
+    """Returns the distinct colors of (height, width, 3) pixels, their counts and the color of every pixel."""
+    keys = (pixels[..., 0].astype(np.uint32) << 16 | pixels[..., 1].astype(np.uint32) << 8 | pixels[..., 2]).ravel()
+    keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    colors = np.stack([keys >> 16, keys >> 8 & 0xff, keys & 0xff], axis=-1).astype(np.int64)
+    return colors, counts, inverse.ravel()
+
+
+def squared_distances(a, b):
+    difference = a - b
+    return np.einsum("...k,...k->...", difference, difference)
+
+
+class ColorTree:
+    """KD-tree over a fixed set of colors, answering which codeword is nearest to each of them.
+
+    The colors are split at the median of their widest channel down to
+    leaves of at most leaf_size colors, each with its bounding box. For a
+    box, the codeword nearest to its middle rules out every codeword that is
+    farther even from the corner of the box lying furthest towards it. The
+    test runs first on groups of neighbouring leaves against the whole
+    codebook and then on every leaf against what is left for its group, and
+    the colors of a leaf are compared with its own candidates only.
+    """
+
+    def __init__(self, colors):
+        self.colors = colors
+        leaf_size = max(MIN_LEAF_SIZE, -(-len(colors) // MAX_LEAVES))
+        # colors of leaf i are colors[order[starts[i]:ends[i]]], leaves in the order of the tree
+        self.order = np.arange(len(colors))
+        starts, ends = [], []
+        stack = [(0, len(colors))]
+        while stack:
+            start, end = stack.pop()
+            block = colors[self.order[start:end]]
+            spread = block.max(axis=0) - block.min(axis=0)
+            if end - start <= leaf_size or not spread.any():
+                starts.append(start)
+                ends.append(end)
+                continue
+            middle = (end - start) // 2
+            self.order[start:end] = self.order[start:end][np.argpartition(block[:, spread.argmax()], middle)]
+            stack += [(start + middle, end), (start, start + middle)]
+        self.starts, self.ends = np.array(starts), np.array(ends)
+        ordered = colors[self.order]
+        self.lows = np.minimum.reduceat(ordered, self.starts)
+        self.highs = np.maximum.reduceat(ordered, self.starts)
+        self.groups = np.arange(len(starts)) // LEAVES_PER_GROUP
+        group_starts = np.arange(0, len(starts), LEAVES_PER_GROUP)
+        self.group_lows = np.minimum.reduceat(self.lows, group_starts)
+        self.group_highs = np.maximum.reduceat(self.highs, group_starts)
+
+    @staticmethod
+    def __prune(lows, highs, codebook, candidates, valid):
+        """Tells which valid candidates, rows of codebook indices, can be nearest to a color of their box."""
+        result = np.empty(candidates.shape, dtype=bool)
+        step = max(1, CHUNK_SIZE // candidates.shape[1])
+        for start in range(0, len(candidates), step):
+            low, high = lows[start:start + step, None], highs[start:start + step, None]
+            chunk_valid = valid[start:start + step]
+            codewords = codebook[candidates[start:start + step]]
+            distances = np.where(chunk_valid, squared_distances((low + high) / 2, codewords), np.inf)
+            best = codewords[np.arange(len(codewords)), distances.argmin(axis=1)][:, None]
+            corner = np.where(codewords > best, high, low)
+            result[start:start + step] = chunk_valid & (squared_distances(corner, codewords)
+                                                        <= squared_distances(corner, best))
+        return result
+
+    @staticmethod
+    def __compact(candidates, valid, width):
+        """Moves the valid candidates of every row to its front and cuts the rows to width."""
+        columns = np.argsort(~valid, axis=1, kind="stable")[:, :width]
+        return np.take_along_axis(candidates, columns, axis=1), np.take_along_axis(valid, columns, axis=1)
+
+    def __candidates(self, codebook):
+        """Returns the candidates of every leaf as rows of codebook indices and which of them are valid."""
+        everything = np.broadcast_to(np.arange(len(codebook)), (len(self.group_lows), len(codebook)))
+        valid = self.__prune(self.group_lows, self.group_highs, codebook, everything,
+                             np.ones(everything.shape, dtype=bool))
+        candidates, valid = self.__compact(everything, valid, valid.sum(axis=1).max())
+        candidates, valid = candidates[self.groups], valid[self.groups]
+        return candidates, self.__prune(self.lows, self.highs, codebook, candidates, valid)
+
+    def nearest(self, codebook):
+        """Returns the index of the nearest codeword of every color and its squared distance."""
+        candidates, valid = self.__candidates(codebook)
+        counts = valid.sum(axis=1)
+        sizes = self.ends - self.starts
+        nearest = np.empty(len(self.colors), dtype=np.intp)
+        distances = np.empty(len(self.colors), dtype=codebook.dtype)
+        # leaves with similar numbers of candidates are compared together, padded to the longest list
+        leaves = np.argsort(counts, kind="stable")
+        ends = np.cumsum(sizes[leaves])
+        first = 0
+        while first < len(leaves):
+            last = first + 1
+            while last < len(leaves) and (ends[last] - ends[first] + sizes[leaves[first]]) * counts[leaves[last]] \
+                    <= CHUNK_SIZE:
+                last += 1
+            group = leaves[first:last]
+            padded, padded_valid = self.__compact(candidates[group], valid[group], counts[group[-1]])
+            # padding repeats the first candidate of the leaf
+            padded = np.where(padded_valid, padded, padded[:, :1])
+            indices = np.concatenate([self.order[self.starts[leaf]:self.ends[leaf]] for leaf in group])
+            point_candidates = np.repeat(padded, sizes[group], axis=0)
+            group_distances = squared_distances(self.colors[indices, None], codebook[point_candidates])
+            best = group_distances.argmin(axis=1)
+            rows = np.arange(len(indices))
+            nearest[indices] = point_candidates[rows, best]
+            distances[indices] = group_distances[rows, best]
+            first = last
+        return nearest, distances
+
+
+def lloyd(codebook, tree, weights, iterations=MAX_ITERATIONS, threshold=THRESHOLD):
+    """Moves every codeword to the centroid of its colors until the distortion improves by less than threshold."""
+    colors = tree.colors
+    previous = math.inf
+    for _ in range(iterations):
+        nearest, distances = tree.nearest(codebook)
+        distortion = weights @ distances
+        totals = np.bincount(nearest, weights, minlength=len(codebook))
+        used = totals > 0
+        for channel in range(3):
+            sums = np.bincount(nearest, weights * colors[:, channel], minlength=len(codebook))
+            codebook[used, channel] = sums[used] / totals[used]
+        if previous - distortion <= threshold * distortion:
+            break
+        previous = distortion
+    return codebook
+
+
+def train(colors, counts, size):
+    """Trains a codebook of size colors, a power of two, on colors weighted by counts.
+
+    Returns the codebook rounded to integer colors and the index of the
+    nearest codeword of every color.
+    """
+    if size >= len(colors):
+        return colors.copy(), np.arange(len(colors))
+    tree, weights = ColorTree(colors.astype(np.float64)), counts.astype(np.float64)
+    codebook = np.average(tree.colors, axis=0, weights=weights)[None]
+    while len(codebook) < size:
+        codebook = lloyd(np.concatenate([codebook - SPLIT_OFFSET, codebook + SPLIT_OFFSET]), tree, weights)
+    codebook = np.clip(np.rint(codebook), 0, 255)
+    nearest, _ = tree.nearest(codebook)
+    return codebook.astype(np.int64), nearest
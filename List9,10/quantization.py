@@ -1,140 +1,139 @@
-import copy
 import math
+import os
+import sys
 from sys import argv
 
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import tga  # noqa: E402
+from common.metrics import (Metrics, mean_squared_errors, peak_signal_to_noise_ratios,  # noqa: E402
+                            signal_to_noise_ratios, to_db)
+from common.tga import COLORS, channel_histograms  # noqa: E402
+from lbg import color_histogram, train  # noqa: E402
+
+MAX_BITS = 8
+
+
+def quantized_values(bits):
+    """Returns the values 0-255 quantized to bits bits."""
+    delta = 256 / 2 ** bits
+    return [int(math.floor(value / delta) * delta + (delta / 2)) for value in range(256)]
+
+
+def quantization_errors(histograms):
+    """Returns errors[channel][bits], the sum of squared errors of every channel quantized to 0-8 bits."""
+    values = np.arange(256, dtype=np.int64)
+    squared_errors = np.array([(values - quantized_values(bits)) ** 2 for bits in range(MAX_BITS + 1)])
+    return histograms.astype(np.int64) @ squared_errors.T
+
+
+def signal_powers(histograms):
+    """Returns the sums of squared values of every channel."""
+    return histograms.astype(np.int64) @ np.arange(256, dtype=np.int64) ** 2
+
 
 class Quantization:
-    def __init__(self, filename, red, green, blue):
+    """Quantizes every channel of image to the number of bits given for it in partition."""
+
+    def __init__(self, image, partition):
         self.width = None
         self.height = None
-        self.image, self.width, self.height = self.__get_image(filename)
-        self.original = copy.deepcopy(self.image)
-        self.red = self.__delta(red)
-        self.green = self.__delta(green)
-        self.blue = self.__delta(blue)
-        self.shift = 18
+        self.image, self.width, self.height = self.__get_image(image)
+        self.original = bytes(self.image)
         self.mse = {}
         self.snr = {}
-        self.partition = {
-            "red": red,
-            "green": green,
-            "blue": blue
-        }
+        self.psnr = {}
+        self.partition = partition
 
-    def __get_image(self, filename):
-        with open(filename, "rb") as f:
-            file = f.read()
-        return list(file), file[13] * 256 + file[12], file[15] * 256 + file[14]
-
-    def __delta(self, bits):
-        return 256 / 2 ** bits
+    def __get_image(self, image):
+        self.image_id = image.image_id
+        return bytearray(image.pixels.tobytes()), image.width, image.height
 
     def image_to_file(self, output):
-        file = open(output, 'wb')
-        file.write(bytes(self.image))
+        pixels = np.frombuffer(self.image, dtype=np.uint8).reshape(self.height, self.width, 3)
+        tga.write(output, pixels, self.image_id)
 
     def quantize(self):
-        for i in range(self.height):
-            for j in range(self.width):
-                index = 3 * (i * self.width + j)
-                self.image[self.shift + index + 2] = self.__quantized_value(self.image[self.shift + index + 2],
-                                                                            self.red)
-                self.image[self.shift + index + 1] = self.__quantized_value(self.image[self.shift + index + 1],
-                                                                            self.green)
-                self.image[self.shift + index] = self.__quantized_value(self.image[self.shift + index], self.blue)
-
-    def __quantized_value(self, old_value, delta):
-        return int(math.floor(old_value / delta) * delta + (delta / 2))
-
-    def __mse_difference(self, i):
-        return (self.original[i] - self.image[i]) ** 2
-
-    def __snr_sum(self, i):
-        return self.original[i] ** 2
-
-    def __snr_to_db(self, snr):
-        if snr == 0:
-            return 0
-        return 10 * math.log10(snr)
-
-    def count_mse(self):
-        red_mse = 0
-        green_mse = 0
-        blue_mse = 0
-        for i in range(self.height):
-            for j in range(self.width):
-                index = 3 * (i * self.width + j)
-                red_mse += self.__mse_difference(self.shift + index + 2)
-                green_mse += self.__mse_difference(self.shift + index + 1)
-                blue_mse += self.__mse_difference(self.shift + index)
-
-        mult = 1 / (self.height * self.width)
-        all_mse = mult * (red_mse + green_mse + blue_mse) / 3
-        red_mse *= mult
-        green_mse *= mult
-        blue_mse *= mult
-
-        self.mse = {
-            "all": all_mse,
-            "red": red_mse,
-            "green": green_mse,
-            "blue": blue_mse
-        }
-
-    def count_snr(self):
-        sum_red = 0
-        sum_green = 0
-        sum_blue = 0
-        for i in range(self.height):
-            for j in range(self.width):
-                index = 3 * (i * self.width + j)
-                sum_red += self.__snr_sum(self.shift + index + 2)
-                sum_green += self.__snr_sum(self.shift + index + 1)
-                sum_blue += self.__snr_sum(self.shift + index)
-        mult = 1 / (self.height * self.width)
-        red_snr = (sum_red * mult / self.mse["red"] if self.mse["red"] != 0 else math.inf)
-        green_snr = (sum_green * mult / self.mse["green"] if self.mse["green"] != 0 else math.inf)
-        blue_snr = (sum_blue * mult / self.mse["blue"] if self.mse["blue"] != 0 else math.inf)
-        all_snr = ((sum_red + sum_green + sum_blue) / 3 * mult / self.mse["all"] if self.mse["all"] != 0 else math.inf)
-        self.snr = {
-            "all": all_snr,
-            "red": red_snr,
-            "green": green_snr,
-            "blue": blue_snr
-        }
+        # every channel is every third byte of the BGR buffer and goes through its own 256-entry table
+        for color, channel in COLORS.items():
+            table = bytes(quantized_values(self.partition[color]))
+            self.image[channel::3] = self.image[channel::3].translate(table)
+
+    def count_errors(self):
+        metrics = Metrics()
+        metrics.update(np.frombuffer(self.original, dtype=np.uint8), np.frombuffer(self.image, dtype=np.uint8))
+        self.mse, self.snr, self.psnr = metrics.mse(), metrics.snr(), metrics.psnr()
 
     def print_errors(self):
         print(f"mse = {self.mse['all']}")
         print(f"mse(r) = {self.mse['red']}")
         print(f"mse(g) = {self.mse['green']}")
         print(f"mse(b) = {self.mse['blue']}")
-        print(f"SNR = {self.snr['all']} ({self.__snr_to_db(self.snr['all'])} dB)")
-        print(f"SNR(r) = {self.snr['red']} ({self.__snr_to_db(self.snr['red'])} dB)")
-        print(f"SNR(g) = {self.snr['green']} ({self.__snr_to_db(self.snr['green'])} dB)")
-        print(f"SNR(b) = {self.snr['blue']} ({self.__snr_to_db(self.snr['blue'])} dB)")
+        print(f"SNR = {self.snr['all']} ({to_db(self.snr['all'])} dB)")
+        print(f"SNR(r) = {self.snr['red']} ({to_db(self.snr['red'])} dB)")
+        print(f"SNR(g) = {self.snr['green']} ({to_db(self.snr['green'])} dB)")
+        print(f"SNR(b) = {self.snr['blue']} ({to_db(self.snr['blue'])} dB)")
+        print(f"PSNR = {self.psnr['all']} dB")
+        print(f"PSNR(r) = {self.psnr['red']} dB")
+        print(f"PSNR(g) = {self.psnr['green']} dB")
+        print(f"PSNR(b) = {self.psnr['blue']} dB")
         print(f"Partition: {self.partition}")
 
 
+class VectorQuantization(Quantization):
+    """Replaces every color with the nearest one of an LBG codebook of 2 ** bits colors."""
+
+    def __init__(self, image, bits):
+        super().__init__(image, {"codebook": 2 ** bits})
+        self.pixels = image.pixels
+
+    def quantize(self):
+        colors, counts, inverse = color_histogram(self.pixels)
+        codebook, nearest = train(colors, counts, self.partition["codebook"])
+        self.image[:] = codebook[nearest[inverse]].astype(np.uint8).tobytes()
+
+
+def vector_quantization(filename, output, bits):
+    quantization = VectorQuantization(tga.read(filename), bits)
+    quantization.quantize()
+    quantization.count_errors()
+    quantization.print_errors()
+    quantization.image_to_file(output)
+
+
 def partition(filename, output, bits, criterion):
+    """Finds the best split of bits between the channels and writes the image quantized with it.
+
+    The error of a channel depends only on its histogram and its own number
+    of bits, so the image is read once and every split is priced from a
+    table of per-channel errors; only the best split is quantized.
+    """
+    image = tga.read(filename)
+    pixels = image.width * image.height
+    histograms = channel_histograms(image.pixels)
+    errors = quantization_errors(histograms).tolist()
+    powers = [int(power) for power in signal_powers(histograms)]
+    blue, green, red = (COLORS[color] for color in ("blue", "green", "red"))
     best_solution = None
-    for i in range(9):
-        for j in range(9):
-            for k in range(9):
+    for i in range(MAX_BITS + 1):
+        for j in range(MAX_BITS + 1):
+            for k in range(MAX_BITS + 1):
                 if i + j + k == bits:
-                    quantization = Quantization(filename, i, j, k)
-                    quantization.quantize()
-                    quantization.count_mse()
+                    mse = mean_squared_errors(errors[red][i], errors[green][j], errors[blue][k], pixels)
+                    snr = signal_to_noise_ratios(mse, powers[red], powers[green], powers[blue], pixels)
                     if criterion == "MSE":
-                        if not best_solution or best_solution.mse["all"] > quantization.mse["all"]:
-                            best_solution = quantization
+                        if not best_solution or best_solution[1]["all"] > mse["all"]:
+                            best_solution = ((i, j, k), mse, snr)
                     else:
-                        quantization.count_snr()
-                        if not best_solution or best_solution.snr["all"] < quantization.snr["all"]:
-                            best_solution = quantization
-    if criterion == "MSE":
-        best_solution.count_snr()
-    best_solution.print_errors()
-    best_solution.image_to_file(output)
+                        if not best_solution or best_solution[2]["all"] < snr["all"]:
+                            best_solution = ((i, j, k), mse, snr)
+    (i, j, k), mse, snr = best_solution
+    quantization = Quantization(image, {"red": i, "green": j, "blue": k})
+    quantization.quantize()
+    quantization.mse, quantization.snr, quantization.psnr = mse, snr, peak_signal_to_noise_ratios(mse)
+    quantization.print_errors()
+    quantization.image_to_file(output)
 
 
 if __name__ == "__main__":
@@ -142,7 +141,9 @@ if __name__ == "__main__":
     output = argv[2]
     bits = int(argv[3])
     criterion = argv[4]
-    if criterion not in ["MSE", "SNR"] or bits < 0 or bits > 24:
+    if criterion not in ["MSE", "SNR", "VQ"] or bits < 0 or bits > 24:
         print("Błędne parametry.")
+    elif criterion == "VQ":
+        vector_quantization(filename, output, bits)
     else:
         partition(filename, output, bits, criterion)
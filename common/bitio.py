@@ -0,0 +1,87 @@
+BUFFER_SIZE = 64 * 1024
+
+
+class BitWriter:
+    """Packs bits MSB first into a bytearray and flushes it to stream in blocks of buffer_size bytes."""
+
+    def __init__(self, stream, buffer_size=BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.accumulator = 0
+        self.accumulator_bits = 0
+        self.bits_written = 0
+
+    def write(self, value, length):
+        self.accumulator = (self.accumulator << length) | value
+        self.accumulator_bits += length
+        self.bits_written += length
+        if self.accumulator_bits >= 8:
+            whole_bits = self.accumulator_bits - self.accumulator_bits % 8
+            self.accumulator_bits -= whole_bits
+            self.buffer += (self.accumulator >> self.accumulator_bits).to_bytes(whole_bits // 8, "big")
+            self.accumulator &= (1 << self.accumulator_bits) - 1
+            if len(self.buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        self.stream.write(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        """Pads the last byte with zeros and flushes everything."""
+        if self.accumulator_bits:
+            self.write(0, 8 - self.accumulator_bits)
+        self.flush()
+
+
+class BitReader:
+    """Reads bits MSB first from stream through a memoryview over chunks of buffer_size bytes.
+
+    The last trailing_bits bits of the stream are padding and are never
+    returned, so they are held back until the end of the stream is reached.
+    """
+
+    def __init__(self, stream, trailing_bits=0, buffer_size=BUFFER_SIZE):
+        self.stream = stream
+        self.trailing_bits = trailing_bits
+        self.buffer_size = buffer_size
+        self.data = memoryview(b"")
+        self.position = 0
+        self.end = 0
+        self.eof = False
+
+    def __fill(self, length):
+        while self.position + length > self.end and not self.eof:
+            chunk = self.stream.read(self.buffer_size)
+            self.eof = not chunk
+            consumed = self.position >> 3
+            self.data = memoryview(self.data[consumed:].tobytes() + chunk)
+            self.position -= consumed * 8
+            self.end = len(self.data) * 8 - self.trailing_bits
+        if self.position + length > self.end:
+            raise EOFError("Unexpected end of compressed data")
+
+    def has_bits(self):
+        if self.position >= self.end and not self.eof:
+            try:
+                self.__fill(1)
+            except EOFError:
+                pass
+        return self.position < self.end
+
+    def read_bit(self):
+        position = self.position
+        if position >= self.end:
+            self.__fill(1)
+            position = self.position
+        self.position = position + 1
+        return (self.data[position >> 3] >> (7 - (position & 7))) & 1
+
+    def read(self, length):
+        if self.position + length > self.end:
+            self.__fill(length)
+        start, end = self.position, self.position + length
+        self.position = end
+        chunk = int.from_bytes(self.data[start >> 3:(end + 7) >> 3], "big")
+        return (chunk >> (-end & 7)) & ((1 << length) - 1)
@@ -0,0 +1,85 @@
+"""Quality metrics of reconstructed images.
+
+Metrics accumulates the sums of squared errors and of squared original
+values of every channel, so mse, SNR and PSNR all come out of one pass over
+the original and reconstructed pixels. Results are dicts with the keys
+"all", "red", "green" and "blue", the format the quantizers print.
+"""
+import math
+
+import numpy as np
+
+from common.tga import COLORS
+
+MAX_VALUE = 255
+# pixels compared at once, which bounds the temporary buffers of update
+CHUNK_PIXELS = 1 << 16
+
+
+def mean_squared_errors(red, green, blue, pixels):
+    """Turns sums of squared errors into the mse of every channel and of the whole image."""
+    mult = 1 / pixels
+    return {
+        "all": mult * (red + green + blue) / 3,
+        "red": red * mult,
+        "green": green * mult,
+        "blue": blue * mult
+    }
+
+
+def signal_to_noise_ratios(mse, sum_red, sum_green, sum_blue, pixels):
+    mult = 1 / pixels
+    red_snr = (sum_red * mult / mse["red"] if mse["red"] != 0 else math.inf)
+    green_snr = (sum_green * mult / mse["green"] if mse["green"] != 0 else math.inf)
+    blue_snr = (sum_blue * mult / mse["blue"] if mse["blue"] != 0 else math.inf)
+    all_snr = ((sum_red + sum_green + sum_blue) / 3 * mult / mse["all"] if mse["all"] != 0 else math.inf)
+    return {
+        "all": all_snr,
+        "red": red_snr,
+        "green": green_snr,
+        "blue": blue_snr
+    }
+
+
+def peak_signal_to_noise_ratios(mse):
+    """Returns the PSNR in dB of every mse."""
+    return {color: 10 * math.log10(MAX_VALUE ** 2 / error) if error != 0 else math.inf
+            for color, error in mse.items()}
+
+
+def to_db(ratio):
+    if ratio == 0:
+        return 0
+    return 10 * math.log10(ratio)
+
+
+class Metrics:
+    """Sums of squared errors and signal powers of every channel of the pixels seen so far."""
+
+    def __init__(self):
+        self.errors = np.zeros(3, dtype=np.int64)
+        self.powers = np.zeros(3, dtype=np.int64)
+        self.pixels = 0
+
+    def update(self, original, reconstructed):
+        """Adds pixels of the original image and the same pixels reconstructed, both (..., 3) BGR arrays."""
+        original = np.asarray(original).reshape(-1, 3)
+        reconstructed = np.asarray(reconstructed).reshape(-1, 3)
+        for start in range(0, len(original), CHUNK_PIXELS):
+            values = original[start:start + CHUNK_PIXELS].astype(np.int64)
+            difference = values - reconstructed[start:start + CHUNK_PIXELS]
+            self.errors += np.einsum("ij,ij->j", difference, difference)
+            self.powers += np.einsum("ij,ij->j", values, values)
+        self.pixels += len(original)
+
+    def __channels(self, sums):
+        return (int(sums[COLORS[color]]) for color in ("red", "green", "blue"))
+
+    def mse(self):
+        return mean_squared_errors(*self.__channels(self.errors), self.pixels)
+
+    def snr(self):
+        return signal_to_noise_ratios(self.mse(), *self.__channels(self.powers), self.pixels)
+
+    def psnr(self):
+        return peak_signal_to_noise_ratios(self.mse())
@@ -0,0 +1,86 @@
+import math
+from collections import Counter
+
+# bytes at the start of an output stream that may be rewritten later, e.g. a
+# header patched once the code length is known
+PATCH_WINDOW = 64
+
+
+def entropy(counts, total):
+    """Entropy in bits per symbol of a histogram given as symbol counts."""
+    result = 0
+    for count in counts:
+        if count:
+            result += (math.log2(count) - math.log2(total)) * (count / total)
+    if result != 0:
+        result *= -1
+    return result
+
+
+def count_compress_ratio(input_data, output_data):
+    return input_data.all_symbols / output_data.all_symbols
+
+
+class Data:
+    """Histogram of the bytes passing through a stream."""
+
+    def __init__(self):
+        self.symbols_count = Counter()
+        self.all_symbols = 0
+
+    def update(self, data):
+        self.symbols_count.update(data)
+        self.all_symbols += len(data)
+
+    def merge(self, other):
+        self.symbols_count.update(other.symbols_count)
+        self.all_symbols += other.all_symbols
+
+    def remove(self, data):
+        self.symbols_count.subtract(data)
+        self.all_symbols -= len(data)
+
+    def count_entropy(self):
+        return entropy(self.symbols_count.values(), self.all_symbols)
+
+    def average_length(self, code_length):
+        return code_length / self.all_symbols
+
+
+class CountingStream:
+    """Wraps a binary stream and counts every byte read from or written to it into data.
+
+    Rewriting bytes within the first PATCH_WINDOW bytes replaces their
+    counts instead of adding to them.
+    """
+
+    def __init__(self, stream, data=None):
+        self.stream = stream
+        self.data = Data() if data is None else data
+        self.position = 0
+        self.end = 0
+        self.head = bytearray()
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.data.update(chunk)
+        self.position += len(chunk)
+        return chunk
+
+    def write(self, b):
+        start, end = self.position, self.position + len(b)
+        overlap = min(end, self.end) - start
+        if overlap > 0:
+            self.data.remove(self.head[start:start + overlap])
+        self.data.update(b)
+        if start < PATCH_WINDOW:
+            self.head[start:min(end, PATCH_WINDOW)] = b[:PATCH_WINDOW - start]
+        self.position, self.end = end, max(self.end, end)
+        return self.stream.write(b)
+
+    def seek(self, offset, whence=0):
+        self.position = self.stream.seek(offset, whence)
+        return self.position
+
+    def tell(self):
+        return self.position
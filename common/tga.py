@@ -0,0 +1,94 @@
+"""Reading and writing of true-color TGA images.
+
+read() memory-maps the file and returns the pixels of an uncompressed image
+as a view of the map, so nothing is copied; RLE-compressed images are
+decoded once into a new buffer. Either way pixels is a (height, width, 3)
+uint8 array of BGR values with the top row first, whatever the origin of
+the file; COLORS maps color names to those channel indices.
+"""
+import mmap
+from struct import calcsize, pack, unpack_from
+
+import numpy as np
+
+# id length, color map type, image type, color map start, color map length,
+# color map entry size, x origin, y origin, width, height, pixel depth, descriptor
+HEADER_FORMAT = "<BBBHHBHHHHBB"
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+UNCOMPRESSED = 2
+RUN_LENGTH_ENCODED = 10
+RIGHT_ORIGIN = 0x10
+TOP_ORIGIN = 0x20
+PIXEL_DEPTHS = (24, 32)
+RUN_PACKET = 0x80
+COLORS = {"blue": 0, "green": 1, "red": 2}
+# shifts every channel to its own 256-value range
+CHANNEL_OFFSETS = np.arange(3, dtype=np.uint16) * 256
+
+
+class Image:
+    def __init__(self, pixels, image_id=b""):
+        self.pixels = pixels
+        self.image_id = image_id
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+
+def channel_histograms(pixels):
+    """Counts the values of every channel of (..., 3) pixels in one bincount; returns a (3, 256) array."""
+    values = np.add(pixels.reshape(-1, 3), CHANNEL_OFFSETS, dtype=np.uint16)
+    return np.bincount(values.ravel(), minlength=3 * 256).reshape(3, 256)
+
+
+def decode_rle(data, offset, count, pixel_size):
+    """Returns count pixels of run-length packets starting at offset as bytes."""
+    result = bytearray()
+    size = count * pixel_size
+    while len(result) < size:
+        packet = data[offset]
+        length = (packet & ~RUN_PACKET) + 1
+        offset += 1
+        if packet & RUN_PACKET:
+            result += data[offset:offset + pixel_size] * length
+            offset += pixel_size
+        else:
+            result += data[offset:offset + length * pixel_size]
+            offset += length * pixel_size
+    return bytes(result[:size])
+
+
+def read(filename):
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (id_length, color_map_type, image_type, _, color_map_length, color_map_entry_size, _, _,
+     width, height, pixel_depth, descriptor) = unpack_from(HEADER_FORMAT, data)
+    if image_type not in (UNCOMPRESSED, RUN_LENGTH_ENCODED) or pixel_depth not in PIXEL_DEPTHS:
+        raise ValueError(f"{filename}: only 24 and 32-bit true-color TGA images are supported")
+    pixel_size = pixel_depth // 8
+    image_id = data[HEADER_SIZE:HEADER_SIZE + id_length]
+    offset = HEADER_SIZE + id_length
+    if color_map_type:
+        offset += color_map_length * ((color_map_entry_size + 7) // 8)
+    if image_type == RUN_LENGTH_ENCODED:
+        data, offset = decode_rle(data, offset, width * height, pixel_size), 0
+    pixels = np.ndarray((height, width, pixel_size), dtype=np.uint8, buffer=data, offset=offset)[..., :3]
+    if not descriptor & TOP_ORIGIN:
+        pixels = pixels[::-1]
+    if descriptor & RIGHT_ORIGIN:
+        pixels = pixels[:, ::-1]
+    return Image(pixels, image_id)
+
+
+def write(filename, pixels, image_id=b""):
+    """Writes (height, width, 3) BGR pixels as an uncompressed 24-bit TGA image with the origin at the bottom."""
+    height, width, _ = pixels.shape
+    header = pack(HEADER_FORMAT, len(image_id), 0, UNCOMPRESSED, 0, 0, 0, 0, 0, width, height, 24, 0)
+    with open(filename, "wb") as f:
+        f.write(header + image_id)
+        f.write(np.ascontiguousarray(pixels[::-1], dtype=np.uint8).data)